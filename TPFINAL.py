@@ -1,38 +1,23 @@
 import pandas as pd
-import numpy as np
 import dash
-from scipy.spatial import Delaunay
-from shapely.geometry import MultiPoint
 from dash import dcc, html, dash_table
 from dash.dependencies import Input, Output
+from data_store import CHART_COLUMNS, load_chart, load_enao
+from figures import load_hull
 import plotly.graph_objs as go
 import plotly.express as px
 
 # Load Data
 
-spotify_top50_daily_wGenres = pd.read_csv('./data/universal_top_songs_final.csv')
-enao = pd.read_csv('./data/enao.csv')
+# the shared table holds the columns of the pages, the song table here also shows popularity and explicitness
+spotify_top50_daily_wGenres = load_chart(CHART_COLUMNS + ['popularity', 'is_explicit'])
+enao = load_enao()
 
 unique_countries = list(zip(spotify_top50_daily_wGenres['country'].unique(),spotify_top50_daily_wGenres['country_name'].unique()))
 dropdown_options = [{'label': country_name, 'value': country_name} for country_code, country_name in unique_countries]
 
-# Enao Alpha Shape
-# Perform Delaunay triangulation
-tri = Delaunay(np.column_stack((enao['left'], enao['top'])))
-
-# Get the indices of the vertices forming the simplices
-simplices = tri.simplices
-
-# Create a polygon from the Delaunay triangulation vertices
-polygon_points = []
-for simplex in simplices:
-    polygon_points.extend(np.array([[enao['left'][i], enao['top'][i]] for i in simplex]))
-alpha_shape = MultiPoint(polygon_points).convex_hull
-
-# Extract x and y coordinates from the alpha shape polygon
-alpha_x, alpha_y = alpha_shape.exterior.xy
-alpha_x = list(alpha_x)  # Convert to list
-alpha_y = list(alpha_y)  # Convert to list
+# Enao Alpha Shape, built by build_hull.py
+alpha_x, alpha_y = load_hull()
 
 
 # Initialize Dash app
@@ -292,7 +277,7 @@ def update_rank_bumpchart(start_date, end_date, country_name):
     trashold = unique_songs['days_in'].sort_values(ascending=False).tolist()[30]
     most_staying_power = filtered_data_wCount[filtered_data_wCount['days_in'] >= trashold]
     
-    summary_df = most_staying_power.groupby(['track_name', 'artists']).agg(mean_rank=('daily_rank', 'mean')).reset_index()
+    summary_df = most_staying_power.groupby(['track_name', 'artists'], observed=True).agg(mean_rank=('daily_rank', 'mean')).reset_index()
     summary_df['mean_rank'] = summary_df['mean_rank'].round(2)
     summary_df = summary_df.sort_values(by='mean_rank')
     # Sort by mean rank and get top 10
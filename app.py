@@ -1,10 +1,95 @@
 import dash
-from dash import Dash, html, dcc
+from dash import Dash, html
 import dash_bootstrap_components as dbc
-import pickle
+import gzip
+import json
+import sys
+from flask import Response, abort, jsonify, request
+from callback_cache import cache_stats, check_json_inputs, invalidate_dates, output_json, serves_json
+from callback_metrics import instrument, instrument_callbacks, prometheus_text
+from cache_warmer import start_warming
 
-app = Dash(__name__, use_pages=True, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# data_store and figures load pandas, NumPy and pyarrow, so the pages import them inside
+# their layouts and callbacks: the app and its health check start without the data layer.
+# Without callback exception checks Dash does not call every page layout on the first
+# request to validate the callbacks against them, which would load it anyway
+app = Dash(__name__, use_pages=True, suppress_callback_exceptions=True, external_stylesheets=[dbc.themes.BOOTSTRAP])
 server = app.server
+
+_refresh_listeners = {'registered': False}
+
+# days ingested while the worker runs are picked up between requests, dropping only the
+# cached outputs whose inputs cover them and computing the default views again.
+# Until a page first loads data_store the worker holds no data that could be stale.
+@server.before_request
+def refresh_data():
+    data_store = sys.modules.get('data_store')
+    if data_store is None:
+        return
+    if not _refresh_listeners['registered']:
+        _refresh_listeners['registered'] = True
+        data_store.on_refresh(invalidate_dates)
+        data_store.on_refresh(start_warming)
+    data_store.maybe_refresh()
+
+# the default views are computed in the background at boot
+start_warming()
+
+# per-stage timings of every page callback, the pages are imported by Dash() above
+instrument_callbacks()
+
+# callback timings, payload sizes and cache counters of this worker for Prometheus
+@server.route('/metrics')
+def metrics():
+    return Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+# liveness probe, answered without loading the chart data
+@server.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# hit and miss counters of the memoized chart callbacks
+@server.route('/cache-stats')
+def callback_cache_stats():
+    return jsonify(cache_stats())
+
+# chart figures as cached JSON, fetched by assets/figures.js for the graphs of the pages,
+# e.g. /figures/update_graph?inputs=["2023-10-18","2024-06-11",["Global"]]
+_figure_outputs = {}
+
+def _figure_output(name):
+    # timed on /metrics like the Dash callbacks, the payload counted is the compressed body
+    output = _figure_outputs.get(name)
+    if output is None:
+        output = _figure_outputs[name] = instrument(name, lambda inputs: output_json(name, inputs),
+                                                    payload_size=lambda entry: len(entry[1]))
+    return output
+
+@server.route('/figures/<name>')
+def cached_figure(name):
+    if not serves_json(name):
+        abort(404)
+    try:
+        inputs = json.loads(request.args.get('inputs', '[]'))
+        check_json_inputs(name, inputs)
+    except (TypeError, ValueError):
+        abort(400)
+    etag, body = _figure_output(name)(inputs)
+
+    response = Response(mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+    if 'gzip' in request.accept_encodings:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_data(body)
+    else:
+        response.set_data(gzip.decompress(body))
+    return response
+
 # styling the sidebar
 SIDEBAR_STYLE = {
     "position": "fixed",
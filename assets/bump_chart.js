@@ -0,0 +1,145 @@
+// Clientside bump chart: the top songs of a date range, computed from the rank matrix that
+// figures.bump_chart_store sends once per country, the same way as staying_power_summary.
+
+(function () {
+    const DAY_MS = 86400000;
+    let decoded = {store: null, ranks: null};
+
+    function ranksOf(store) {
+        // the matrix is decoded once per country, not on every date change
+        if (decoded.store !== store) {
+            const bytes = Uint8Array.from(atob(store.ranks), (c) => c.charCodeAt(0));
+            decoded = {store: store, ranks: new Int8Array(bytes.buffer)};
+        }
+        return decoded.ranks;
+    }
+
+    function dayNumber(date) {
+        return Math.floor(Date.UTC(+date.slice(0, 4), +date.slice(5, 7) - 1, +date.slice(8, 10)) / DAY_MS);
+    }
+
+    function dateString(day) {
+        return new Date(day * DAY_MS).toISOString().slice(0, 10);
+    }
+
+    // numpy.round(value, 2): round half to even after scaling, so ties match the server
+    function round2(value) {
+        const scaled = value * 100;
+        let rounded = Math.round(scaled);
+        if (rounded - scaled === 0.5 && rounded % 2 !== 0) {
+            rounded -= 1;
+        }
+        return rounded / 100;
+    }
+
+    function bumpChart(store, startDate, endDate) {
+        if (!store) {
+            return window.dash_clientside.no_update;
+        }
+        const figure = {data: [], layout: store.layout};
+        const nRows = store.row_track.length;
+        const nDays = store.days;
+        const first = Math.max(dayNumber(startDate) - store.first_day, 0);
+        const last = Math.min(dayNumber(endDate) - store.first_day, nDays - 1);
+        if (nRows === 0 || first > last) {
+            return figure;
+        }
+        const ranks = ranksOf(store);
+
+        // days in and rank sums per (track, artists) pair, days per track
+        let nPairs = 0;
+        store.row_pair.forEach((pair) => { nPairs = Math.max(nPairs, pair + 1); });
+        const pairDays = new Int32Array(nPairs);
+        const pairSums = new Int32Array(nPairs);
+        const pairTrack = new Int32Array(nPairs);
+        const trackDays = new Int32Array(store.tracks.length);
+        for (let row = 0; row < nRows; row++) {
+            const pair = store.row_pair[row];
+            pairTrack[pair] = store.row_track[row];
+            for (let day = first; day <= last; day++) {
+                const rank = ranks[row * nDays + day];
+                if (rank > 0) {
+                    pairDays[pair] += 1;
+                    pairSums[pair] += rank;
+                    trackDays[store.row_track[row]] += 1;
+                }
+            }
+        }
+
+        // chart rows of a song repeated on a day count like the others
+        const extras = [];
+        store.extra_rows.forEach((row, number) => {
+            const day = store.extra_days[number];
+            if (day >= first && day <= last) {
+                const pair = store.row_pair[row];
+                pairDays[pair] += 1;
+                pairSums[pair] += store.extra_ranks[number];
+                trackDays[store.row_track[row]] += 1;
+                extras.push([row, day, store.extra_ranks[number]]);
+            }
+        });
+
+        // tracks with at least as many days as the staying-th one
+        const charting = Array.from(trackDays).filter((days) => days > 0).sort((a, b) => b - a);
+        if (charting.length === 0) {
+            return figure;
+        }
+        const threshold = charting[Math.min(store.staying, charting.length) - 1];
+        const candidates = [];
+        for (let pair = 0; pair < nPairs; pair++) {
+            if (pairDays[pair] > 0 && trackDays[pairTrack[pair]] >= threshold) {
+                candidates.push({pair: pair, meanRank: round2(pairSums[pair] / pairDays[pair])});
+            }
+        }
+        candidates.sort((a, b) => a.meanRank - b.meanRank || a.pair - b.pair);
+        const selected = new Set(candidates.slice(0, store.top).map((candidate) => pairTrack[candidate.pair]));
+
+        // every chart entry of the selected tracks, one line per track in order of first appearance
+        const points = new Map();
+        for (let row = 0; row < nRows; row++) {
+            const track = store.row_track[row];
+            if (!selected.has(track)) {
+                continue;
+            }
+            if (!points.has(track)) {
+                points.set(track, []);
+            }
+            for (let day = first; day <= last; day++) {
+                const rank = ranks[row * nDays + day];
+                if (rank > 0) {
+                    points.get(track).push([day, rank]);
+                }
+            }
+        }
+        extras.forEach(([row, day, rank]) => {
+            const track = store.row_track[row];
+            if (selected.has(track)) {
+                points.get(track).push([day, rank]);
+            }
+        });
+        const lines = Array.from(points.entries()).map(([track, trackPoints]) => {
+            trackPoints.sort((a, b) => a[0] - b[0] || a[1] - b[1]);
+            return {track: track, points: trackPoints};
+        });
+        lines.sort((a, b) => a.points[0][0] - b.points[0][0] || a.points[0][1] - b.points[0][1]);
+
+        figure.data = lines.map((line, number) => {
+            const name = store.tracks[line.track];
+            return {
+                type: 'scattergl',
+                mode: 'lines',
+                x: line.points.map((point) => dateString(store.first_day + point[0])),
+                y: line.points.map((point) => point[1]),
+                name: name,
+                legendgroup: name,
+                line: {color: store.colors[number % store.colors.length]},
+                hovertemplate: `track_name=${name}<br>Date=%{x}<br>Daily Rank=%{y}<extra></extra>`,
+            };
+        });
+        return figure;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        ranking: {bumpChart: bumpChart},
+    });
+})();
@@ -0,0 +1,48 @@
+// Chart figures fetched from the /figures route, which serves the cached JSON of a callback's
+// output with an ETag: a view shown before is answered with a 304 and drawn from the kept body.
+
+(function () {
+    // response bodies kept per URL, the least recently shown one is dropped first
+    const MAX_FIGURES = 32;
+    const figures = new Map();
+
+    function figureUrl(name, inputs) {
+        const config = JSON.parse(document.getElementById('_dash-config').textContent);
+        const prefix = config.requests_pathname_prefix || '/';
+        return `${prefix}figures/${name}?inputs=${encodeURIComponent(JSON.stringify(inputs))}`;
+    }
+
+    async function fetchFigure(name, inputs) {
+        const url = figureUrl(name, inputs);
+        const kept = figures.get(url);
+        // the browser cache is bypassed, the kept bodies are revalidated here instead
+        const response = await fetch(url, {cache: 'no-store', headers: kept ? {'If-None-Match': kept.etag} : {}});
+        let entry = kept;
+        if (response.status !== 304 || !kept) {
+            if (!response.ok) {
+                // inputs the server cannot draw, e.g. no country selected, keep the shown figure
+                return window.dash_clientside.no_update;
+            }
+            entry = {etag: response.headers.get('ETag'), body: await response.text()};
+        }
+        figures.delete(url);
+        figures.set(url, entry);
+        if (figures.size > MAX_FIGURES) {
+            figures.delete(figures.keys().next().value);
+        }
+        // parsed on every view, plotly changes the figures it draws
+        return JSON.parse(entry.body);
+    }
+
+    function rankBumpChart(startDate, endDate, countryName) {
+        return fetchFigure('update_rank_bumpchart', [startDate, endDate, countryName]);
+    }
+
+    function genreGraph(startDate, endDate, countryNames) {
+        return fetchFigure('update_graph', [startDate, endDate, countryNames]);
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        figures: {rankBumpChart: rankBumpChart, genreGraph: genreGraph},
+    });
+})();
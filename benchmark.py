@@ -0,0 +1,386 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Benchmark of the data layer and the page callbacks on synthetic Top 50 charts, e.g.
+#   python benchmark.py generate /tmp/bench --countries 72 --days 240
+#   python benchmark.py run /tmp/bench --output results.json
+#   python benchmark.py run /tmp/bench --backend duckdb --output duckdb.json
+#   python benchmark.py compare baseline.json results.json
+# generated data mirrors ./data, so the app itself can also be started from that directory
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+GENERATOR_PATH = 'generator.json'
+CHART_SIZE = 50
+ALPHABET = np.array(list('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'))
+
+# Date ranges of the timed calls, in days, 0 is the whole span
+RANGE_DAYS = [7, 30, 90, 0]
+GRAPH_COUNTRIES = [1, 10, 70]
+PERCENTILES = [50, 90, 99]
+# modules imported by app listed in the startup report, the slowest first
+IMPORT_MODULES = 15
+
+# Run in a fresh interpreter by startup(), -X importtime reports the imports on stderr
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+timings = {'import_app_ms': (time.perf_counter() - start) * 1000}
+client = app.server.test_client()
+for name, path in [('first_healthz_ms', '/healthz'), ('first_index_ms', '/')]:
+    start = time.perf_counter()
+    client.get(path)
+    timings[name] = (time.perf_counter() - start) * 1000
+timings['data_layer_imported'] = 'data_store' in sys.modules
+print(json.dumps(timings))
+'''
+
+
+# Synthetic data
+
+def _random_ids(rng, n, length=22):
+    '''
+        n random base62 strings shaped like Spotify ids
+    '''
+    chars = ALPHABET[rng.integers(0, len(ALPHABET), size=(n, length))]
+    return np.ascontiguousarray(chars).view(f'<U{length}').ravel()
+
+
+def _zipf_weights(n, exponent):
+    weights = 1 / np.arange(1, n + 1, dtype=np.float64) ** exponent
+    return weights / weights.sum()
+
+
+def _enao(rng, n_genres):
+    return pd.DataFrame({
+        'genre': [f'genre {number:05d}' for number in range(n_genres)],
+        'left': rng.uniform(0, 1450, n_genres).round(),
+        'top': rng.uniform(0, 22500, n_genres).round(),
+        'color': [f'#{value:06x}' for value in rng.integers(0, 1 << 24, n_genres)],
+    })
+
+
+def _tracks(rng, n_tracks, genre_names, genres_per_track, start):
+    '''
+        track attributes, with genres drawn per artist like the Spotify API does
+    '''
+    n_artists = max(n_tracks // 4, 1)
+    artist_genres = []
+    genre_weights = _zipf_weights(len(genre_names), 0.7)
+    for n_genres in rng.poisson(genres_per_track, n_artists):
+        picks = rng.choice(len(genre_names), size=min(n_genres, len(genre_names)), replace=False, p=genre_weights)
+        artist_genres.append(', '.join(genre_names[picks]) if len(picks) else np.nan)
+    artist_genres = np.array(artist_genres, dtype=object)
+
+    # a few tracks share a name with another one (covers, remixes), some have two artists
+    name_numbers = np.arange(n_tracks)
+    covers = rng.random(n_tracks) < 0.03
+    name_numbers[covers] = rng.integers(0, n_tracks, covers.sum())
+    first_artist = rng.integers(0, n_artists, n_tracks)
+    second_artist = rng.integers(0, n_artists, n_tracks)
+    artists = np.array([f'Artist {number}' for number in first_artist], dtype=object)
+    featuring = rng.random(n_tracks) < 0.3
+    artists[featuring] = [f'Artist {a}, Artist {b}' for a, b in zip(first_artist[featuring], second_artist[featuring])]
+    release_days = rng.integers(0, 9 * 365, n_tracks)
+
+    return pd.DataFrame({
+        'spotify_id': _random_ids(rng, n_tracks),
+        'track_name': [f'Track {number}' for number in name_numbers],
+        'artists': artists,
+        'album_release_date': (np.datetime64(start, 'D') - release_days).astype(str),
+        'genres': artist_genres[first_artist],
+        'popularity': rng.integers(40, 100, n_tracks),
+    })
+
+
+def _country_charts(rng, n_days, n_tracks, pool_size, churn):
+    '''
+        (days, CHART_SIZE) track numbers of one country's daily charts, best rank first
+    '''
+    pool = rng.choice(n_tracks, size=min(pool_size, n_tracks), replace=False)
+    weights = _zipf_weights(len(pool), 0.9)
+    charts = np.empty((n_days, CHART_SIZE), dtype=np.int64)
+    chart = rng.choice(pool, size=CHART_SIZE, replace=False, p=weights)
+    for day in range(n_days):
+        # the lower half drops out more often, new entries land anywhere
+        n_out = min(rng.binomial(CHART_SIZE, churn), CHART_SIZE)
+        if n_out:
+            out = rng.choice(CHART_SIZE, size=n_out, replace=False, p=_zipf_weights(CHART_SIZE, -1))
+            kept = np.delete(chart, out)
+            candidates = rng.choice(pool, size=4 * n_out, p=weights)
+            candidates = pd.unique(candidates[~np.isin(candidates, kept)])
+            while len(candidates) < n_out:
+                extra = rng.choice(pool, size=4 * n_out)
+                candidates = pd.unique(np.concatenate([candidates, extra[~np.isin(extra, kept)]]))
+            chart = np.concatenate([kept, candidates[:n_out]])
+            positions = np.concatenate([np.delete(np.arange(CHART_SIZE), out), rng.uniform(0, CHART_SIZE, n_out)])
+        else:
+            positions = np.arange(CHART_SIZE, dtype=np.float64)
+        chart = chart[np.argsort(positions + rng.normal(0, 1.5, CHART_SIZE), kind='stable')]
+        charts[day] = chart
+    return charts
+
+
+def _movements(charts, lag):
+    '''
+        rank change of every chart entry since lag days before, 0 for new entries
+    '''
+    movements = np.zeros(charts.shape, dtype=np.int64)
+    ranks = np.arange(1, CHART_SIZE + 1)
+    for day in range(lag, len(charts)):
+        previous = charts[day - lag]
+        order = np.argsort(previous)
+        found = np.searchsorted(previous[order], charts[day]).clip(max=CHART_SIZE - 1)
+        known = previous[order][found] == charts[day]
+        movements[day, known] = ranks[order][found][known] - ranks[known]
+    return movements
+
+
+def generate(directory, countries=72, days=240, tracks=20_000, pool=2_000, churn=0.08, genres=6_000, genres_per_track=2.5,
+             start='2023-10-18', seed=0):
+    '''
+        write a deterministic synthetic chart CSV, ENAO table and genre-space outline
+        to directory/data, in the layout the app reads
+    '''
+    rng = np.random.default_rng(seed)
+    data_dir = os.path.join(directory, 'data')
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+
+    enao = _enao(rng, genres)
+    enao.to_csv(os.path.join(data_dir, 'enao.csv'), index=False)
+    # imported here, run() times the first import of the data layer
+    from build_hull import write_hull
+    from figures import HULL_PATH
+    write_hull(enao['left'], enao['top'], path=os.path.join(data_dir, os.path.basename(HULL_PATH)))
+
+    track_table = _tracks(rng, tracks, enao['genre'].to_numpy(), genres_per_track, start)
+    dates = np.datetime64(start, 'D') + np.arange(days)
+    frames = []
+    for number in range(countries):
+        # the first country is the Global chart, which has no country code
+        code = np.nan if number == 0 else chr(65 + number // 26 % 26) + chr(65 + number % 26)
+        name = 'Global' if number == 0 else f'Country {number:02d}'
+        charts = _country_charts(rng, days, tracks, pool, churn)
+        frame = track_table.iloc[charts.ravel()].reset_index(drop=True)
+        frame['daily_rank'] = np.tile(np.arange(1, CHART_SIZE + 1), days)
+        frame['daily_movement'] = _movements(charts, 1).ravel()
+        frame['weekly_movement'] = _movements(charts, 7).ravel()
+        frame['country'] = code
+        frame['snapshot_date'] = np.repeat(dates, CHART_SIZE).astype(str)
+        frame['country_name'] = name
+        frames.append(frame)
+
+    # newest days first, like the scraped file
+    chart = pd.concat(frames, ignore_index=True)
+    days_before_last = np.datetime64(dates[-1], 'D') - chart['snapshot_date'].to_numpy().astype('datetime64[D]')
+    chart = chart.iloc[np.argsort(days_before_last, kind='stable')]
+    columns = ['spotify_id', 'track_name', 'artists', 'daily_rank', 'daily_movement', 'weekly_movement', 'country',
+               'snapshot_date', 'popularity', 'album_release_date', 'genres', 'country_name']
+    chart[columns].to_csv(os.path.join(data_dir, 'universal_top_songs_final.csv'), index=False)
+
+    config = {'countries': countries, 'days': days, 'tracks': tracks, 'pool': pool, 'churn': churn, 'genres': genres,
+              'genres_per_track': genres_per_track, 'start': start, 'seed': seed, 'rows': len(chart)}
+    with open(os.path.join(directory, GENERATOR_PATH), 'w') as file:
+        json.dump(config, file, indent=2)
+    return config
+
+
+# Timing
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    value = function(*args)
+    return (time.perf_counter() - start) * 1000, value
+
+
+def _summary(timings):
+    timings = np.array(timings)
+    summary = {f'p{percentile}': round(float(np.percentile(timings, percentile)), 3) for percentile in PERCENTILES}
+    summary.update({'mean': round(float(timings.mean()), 3), 'max': round(float(timings.max()), 3), 'n': len(timings)})
+    return summary
+
+
+def startup(directory):
+    '''
+        import time of the app and its slowest modules, and the first requests, in a fresh interpreter
+    '''
+    environment = dict(os.environ, CACHE_WARM='off', PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT], cwd=directory, env=environment,
+                             capture_output=True, text=True, check=True)
+    report = {name: round(value, 3) if isinstance(value, float) else value
+              for name, value in json.loads(process.stdout.strip().splitlines()[-1]).items()}
+
+    # lines are 'import time: self [us] | cumulative | module', printed once a module is done,
+    # so the modules app imports directly, two spaces deeper, come before the line of app
+    children = {}
+    for line in process.stderr.splitlines():
+        fields = line.removeprefix('import time:').split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name, depth, cumulative = fields[2].strip(), len(fields[2]) - len(fields[2].lstrip()), int(fields[1]) / 1000
+        if depth == 1:
+            if name == 'app':
+                report['app_imports_ms'] = {module: round(value, 3) for module, value in
+                                            sorted(children.items(), key=lambda item: -item[1])[:IMPORT_MODULES]}
+            children = {}
+        elif depth == 3:
+            children[name] = cumulative
+    return report
+
+
+def _date_ranges(rng, first_date, last_date, iterations):
+    days = pd.date_range(first_date, last_date).strftime('%Y-%m-%d')
+    ranges = []
+    for iteration in range(iterations):
+        length = RANGE_DAYS[iteration % len(RANGE_DAYS)] or len(days)
+        start = rng.integers(0, max(len(days) - length, 0) + 1)
+        ranges.append((days[start], days[min(start + length, len(days)) - 1]))
+    return ranges
+
+
+def run(directory, iterations=50, seed=0, keep_cache=False, backend=None):
+    '''
+        time cold start and the uncached page callbacks on the generated data of directory,
+        with the query backend of QUERY_BACKEND unless another one is given
+    '''
+    os.chdir(directory)
+    sys.path.insert(0, REPO_DIR)
+    # the background cache warmer would compete with the timed calls
+    os.environ.setdefault('CACHE_WARM', 'off')
+    if backend:
+        os.environ['QUERY_BACKEND'] = backend
+    if not keep_cache:
+        shutil.rmtree('./data/cache', ignore_errors=True)
+    results = {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+               'backend': os.environ.get('QUERY_BACKEND', 'pandas')}
+    if os.path.exists(GENERATOR_PATH):
+        with open(GENERATOR_PATH) as file:
+            results['generator'] = json.load(file)
+
+    results['startup'] = startup(os.getcwd())
+
+    # cold start: imports, cache build and the first call of every callback on an empty state
+    cold = {}
+    cold['import_app_ms'], _ = _timed(importlib.import_module, 'app')
+    import data_store
+    from plotly.io.json import to_json_plotly
+    cold['build_cache_ms'], _ = _timed(data_store.ensure_chart_cache)
+    rss = {'after_import_and_build': _peak_rss_mb()}
+
+    # the memoized callbacks are timed through the functions they wrap, with Dash's serialization
+    ranking, genres = sys.modules['pages.ranking'], sys.modules['pages.genres']
+    callbacks = {
+        'update_rank_bumpchart': ranking.update_rank_bumpchart.__wrapped__,
+        'update_graph': genres.update_graph.__wrapped__,
+        'update_table': ranking.update_table.__wrapped__,
+    }
+    first_date, last_date = data_store.date_span()
+    countries = [option['value'] for option in data_store.country_options()]
+    cold['country_options_and_date_span_ms'], _ = _timed(lambda: (data_store.country_options(), data_store.date_span()))
+    cold['update_rank_bumpchart_ms'], _ = _timed(lambda: to_json_plotly(callbacks['update_rank_bumpchart'](first_date, last_date, 'Global')))
+    cold['update_graph_ms'], _ = _timed(lambda: to_json_plotly(callbacks['update_graph'](first_date, last_date, ['Global'])))
+    cold['update_table_ms'], _ = _timed(lambda: to_json_plotly(callbacks['update_table'](first_date, 'Global', None, 0, 10, [], '')))
+    results['cold_start'] = {name: round(value, 3) for name, value in cold.items()}
+    rss['after_cold_start'] = _peak_rss_mb()
+
+    rng = np.random.default_rng(seed)
+    ranges = _date_ranges(rng, first_date, last_date, iterations)
+    timings, payloads = {}, {}
+
+    def measure(name, function, *args):
+        elapsed, value = _timed(function, *args)
+        timings.setdefault(name, []).append(elapsed)
+        if isinstance(value, (dict, list, tuple)):
+            payloads.setdefault(name, []).append(len(to_json_plotly(value)))
+
+    for iteration, (start_date, end_date) in enumerate(ranges):
+        country = countries[rng.integers(len(countries))]
+        measure('filter_by_country_and_date', data_store.filter_by_country_and_date, start_date, end_date, country)
+        measure('update_rank_bumpchart', callbacks['update_rank_bumpchart'], start_date, end_date, country)
+        for n_countries in GRAPH_COUNTRIES:
+            selection = list(rng.choice(countries, size=min(n_countries, len(countries)), replace=False))
+            measure(f'update_graph_{n_countries}', callbacks['update_graph'], start_date, end_date, selection)
+        sort_by = [] if iteration % 2 else [{'column_id': 'daily_rank', 'direction': 'desc'}]
+        measure('update_table', callbacks['update_table'], start_date, country, None, int(rng.integers(0, 3)), 10, sort_by, '')
+
+    results['latency_ms'] = {name: _summary(values) for name, values in timings.items()}
+    results['payload_bytes'] = {name: int(np.mean(values)) for name, values in payloads.items()}
+    rss['peak'] = _peak_rss_mb()
+    results['peak_rss_mb'] = rss
+    return results
+
+
+def compare(baseline, current):
+    '''
+        ratio of every latency percentile, startup and cold start timing, current over baseline
+    '''
+    ratios = {}
+    for name, summary in current.get('latency_ms', {}).items():
+        old = baseline.get('latency_ms', {}).get(name)
+        if old:
+            ratios[name] = {key: round(summary[key] / old[key], 2) for key in summary if key.startswith('p') and old.get(key)}
+    for section in ['startup', 'cold_start']:
+        for name, value in current.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if isinstance(value, float) and old:
+                ratios[f'{section}.{name}'] = round(value / old, 2)
+    return ratios
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data layer and callbacks on synthetic Top 50 charts')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_parser = commands.add_parser('generate', help='write synthetic data to DIRECTORY/data')
+    generate_parser.add_argument('directory')
+    generate_parser.add_argument('--countries', type=int, default=72, help='charts, the first one is Global')
+    generate_parser.add_argument('--days', type=int, default=240)
+    generate_parser.add_argument('--tracks', type=int, default=20_000, help='distinct tracks of all countries')
+    generate_parser.add_argument('--pool', type=int, default=2_000, help='tracks that can chart in one country')
+    generate_parser.add_argument('--churn', type=float, default=0.08, help='share of a chart replaced every day')
+    generate_parser.add_argument('--genres', type=int, default=6_000, help='ENAO genres')
+    generate_parser.add_argument('--genres-per-track', type=float, default=2.5)
+    generate_parser.add_argument('--seed', type=int, default=0)
+    run_parser = commands.add_parser('run', help='time the callbacks on generated data, in a fresh process')
+    run_parser.add_argument('directory')
+    run_parser.add_argument('--iterations', type=int, default=50)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--keep-cache', action='store_true', help='reuse the built chart cache')
+    run_parser.add_argument('--backend', choices=['pandas', 'duckdb'], help='query backend, QUERY_BACKEND by default')
+    run_parser.add_argument('--output', help='JSON file for the results, printed when omitted')
+    compare_parser = commands.add_parser('compare', help='latency ratios of two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        config = generate(args.directory, args.countries, args.days, args.tracks, args.pool, args.churn, args.genres,
+                          args.genres_per_track, seed=args.seed)
+        print(f"Generated {config['rows']} chart rows in {os.path.join(args.directory, 'data')}")
+    elif args.command == 'run':
+        output = os.path.abspath(args.output) if args.output else None
+        results = run(args.directory, args.iterations, args.seed, args.keep_cache, args.backend)
+        if output:
+            with open(output, 'w') as file:
+                json.dump(results, file, indent=2)
+        else:
+            print(json.dumps(results, indent=2))
+    elif args.command == 'compare':
+        with open(args.baseline) as baseline, open(args.current) as current:
+            print(json.dumps(compare(json.load(baseline), json.load(current)), indent=2))
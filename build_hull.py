@@ -0,0 +1,122 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from scipy.spatial import ConvexHull, Delaunay
+from data_store import ENAO_PATH
+from figures import HULL_PATH
+
+# Outline of the Every Noise at Once genre-space drawn around the genre plots, e.g.
+#   python build_hull.py                        (convex hull)
+#   python build_hull.py --alpha 8              (concave alpha shape)
+# the pages read HULL_PATH when they first draw a genre-space figure
+
+
+def _boundary_edges(points, alpha):
+    '''
+        (start, end) point indices of the alpha shape outline, counter-clockwise around the shape:
+        the Delaunay triangle edges with a single triangle of circumradius below 1 / alpha
+    '''
+    triangulation = Delaunay(points)
+    simplices, neighbors = triangulation.simplices, triangulation.neighbors
+    a, b, c = points[simplices[:, 0]], points[simplices[:, 1]], points[simplices[:, 2]]
+    # twice the signed area, negative for clockwise triangles
+    cross = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+    sides = np.linalg.norm(a - b, axis=1) * np.linalg.norm(b - c, axis=1) * np.linalg.norm(c - a, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kept = sides / (2 * np.abs(cross)) < 1 / alpha
+
+    # the edge opposite corner k of a triangle borders neighbors[:, k], -1 outside the triangulation
+    outline = kept[:, None] & ((neighbors < 0) | ~kept[neighbors])
+    triangle, corner = np.nonzero(outline)
+    start, end = simplices[triangle, (corner + 1) % 3], simplices[triangle, (corner + 2) % 3]
+    clockwise = cross[triangle] < 0
+    return np.column_stack([np.where(clockwise, end, start), np.where(clockwise, start, end)])
+
+
+def _rings(edges):
+    '''
+        closed point index lists chaining the boundary edges, the longest first
+    '''
+    outgoing = {}
+    for start, end in edges.tolist():
+        outgoing.setdefault(start, []).append(end)
+    rings = []
+    while outgoing:
+        first = vertex = next(iter(outgoing))
+        ring = [first]
+        while True:
+            targets = outgoing[vertex]
+            if len(targets) == 1:
+                del outgoing[vertex]
+            vertex = targets.pop()
+            ring.append(vertex)
+            if vertex == first:
+                break
+        rings.append(np.array(ring))
+    return sorted(rings, key=len, reverse=True)
+
+
+def _drop_collinear(points, ring):
+    # points of a closed ring lying on the segment between their neighbours
+    before, after = points[np.roll(ring[:-1], 1)], points[np.roll(ring[:-1], -1)]
+    here = points[ring[:-1]]
+    cross = (here[:, 0] - before[:, 0]) * (after[:, 1] - before[:, 1]) - (here[:, 1] - before[:, 1]) * (after[:, 0] - before[:, 0])
+    kept = ring[:-1][cross != 0]
+    return np.append(kept, kept[:1])
+
+
+def _plain(values):
+    return values.astype(np.int64).tolist() if np.all(values == np.round(values)) else values.tolist()
+
+
+def build_hull(left, top, alpha=0.0):
+    '''
+        outline rings of the genre coordinates as {'x', 'y'} lists, the convex hull for an alpha of 0;
+        alpha applies to the coordinates scaled to the unit square, so both axes weigh the same
+    '''
+    points = np.column_stack([np.asarray(left, dtype=np.float64), np.asarray(top, dtype=np.float64)])
+    low, high = points.min(axis=0), points.max(axis=0)
+    scaled = (points - low) / np.where(high > low, high - low, 1)
+    if alpha > 0:
+        edges = _boundary_edges(scaled, alpha)
+        if len(edges) == 0:
+            raise ValueError(f'no genre-space triangle is kept with an alpha of {alpha}, use a smaller alpha')
+        outline = _rings(edges)
+    else:
+        # the outline of every triangle, qhull finds it without the triangulation
+        vertices = ConvexHull(scaled).vertices
+        outline = [np.append(vertices, vertices[:1])]
+
+    rings = []
+    for ring in outline:
+        ring = _drop_collinear(scaled, ring)
+        if len(ring) > 3:
+            rings.append({'x': _plain(points[ring, 0]), 'y': _plain(points[ring, 1])})
+    return rings
+
+
+def write_hull(left, top, alpha=0.0, path=HULL_PATH):
+    '''
+        build the outline of the genre coordinates and write it to path as JSON
+    '''
+    rings = build_hull(left, top, alpha)
+    with open(path, 'w') as file:
+        json.dump({'alpha': alpha, 'rings': rings}, file, separators=(',', ':'))
+    return rings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the outline of the ENAO genre-space')
+    parser.add_argument('--source', default=ENAO_PATH, help='ENAO CSV file with left and top columns')
+    parser.add_argument('--output', default=HULL_PATH)
+    parser.add_argument('--alpha', type=float, default=0.0,
+                        help='0 for the convex hull, larger values follow the genres more closely')
+    args = parser.parse_args()
+
+    enao = pd.read_csv(args.source, usecols=['left', 'top'])
+    start = time.perf_counter()
+    rings = write_hull(enao['left'], enao['top'], args.alpha, args.output)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"Wrote {len(rings)} rings with {sum(len(ring['x']) for ring in rings)} points around {len(enao)} genres to {args.output} in {elapsed:.1f}ms")
@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from callback_cache import warm
+
+# Configuration, read from the environment like callback_cache's
+
+WARM_ENABLED = os.environ.get('CACHE_WARM', 'on') != 'off'
+# countries whose views are precomputed, separated by ';' since some names contain commas
+WARM_COUNTRIES = [name.strip() for name in os.environ.get('CACHE_WARM_COUNTRIES', 'Global').split(';') if name.strip()]
+# date ranges ending on the last charted day, in days, 0 is the whole span the pages open with
+WARM_DAYS = [int(days) for days in os.environ.get('CACHE_WARM_DAYS', '0,7,30,90').split(',') if days.strip()]
+# seconds between two precomputed views, so the warmer leaves the interpreter to requests
+WARM_PAUSE = float(os.environ.get('CACHE_WARM_PAUSE', 0.05))
+
+logger = logging.getLogger(__name__)
+
+_warming = {'generation': 0, 'thread': None}
+_warming_lock = threading.Lock()
+
+
+def hot_inputs():
+    '''
+        (callback name, inputs) of the views to precompute, as the pages send them,
+        or ('rank_matrix', (country name,)) for the data of a clientside bump chart
+    '''
+    # imported by the warmer thread, the app module does not wait for the data layer
+    from data_store import country_options, date_span
+    # the ranking page, imported by Dash, draws the bump chart in the browser in client mode
+    from pages.ranking import BUMP_CHART_MODE
+    first_date, last_date = date_span()
+    countries = {option['value'] for option in country_options()}
+    ranges = []
+    for days in WARM_DAYS:
+        start_date = first_date if days <= 0 else max(first_date, (date.fromisoformat(last_date) - timedelta(days=days - 1)).isoformat())
+        if (start_date, last_date) not in ranges:
+            ranges.append((start_date, last_date))
+
+    inputs = []
+    for country_name in WARM_COUNTRIES:
+        if country_name not in countries:
+            continue
+        if BUMP_CHART_MODE == 'client':
+            # the rank matrix the page's store is built from, the same for every date range
+            inputs.append(('rank_matrix', (country_name,)))
+        for start_date, end_date in ranges:
+            if BUMP_CHART_MODE != 'client':
+                inputs.append(('update_rank_bumpchart', (start_date, end_date, country_name)))
+            inputs.append(('update_graph', (start_date, end_date, [country_name])))
+            # the first table page of the day the bump chart starts on
+            inputs.append(('update_table', (start_date, country_name, None, 0, 10, [], '')))
+    return inputs
+
+
+def _lower_priority():
+    # Linux threads have their own nice value, elsewhere the whole process would be affected
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+
+def _warm_views():
+    _lower_priority()
+    while True:
+        with _warming_lock:
+            generation = _warming['generation']
+        started = time.perf_counter()
+        try:
+            # the home page figure does not depend on the chart data, it is built once
+            from figures import genre_space_figure
+            genre_space_figure()
+            inputs = hot_inputs()
+        except Exception:
+            logger.exception('could not list the views to precompute')
+            inputs = []
+        for name, args in inputs:
+            # a refresh during the run starts it over on the new data
+            if _warming['generation'] != generation:
+                break
+            try:
+                if name == 'rank_matrix':
+                    # shared by the worker's current data, not a cached callback output
+                    from data_store import rank_matrix
+                    rank_matrix(*args)
+                else:
+                    warm(name, args)
+            except Exception:
+                logger.exception('could not precompute %s%r', name, args)
+            time.sleep(WARM_PAUSE)
+        else:
+            logger.info('precomputed %d views in %.1fs', len(inputs), time.perf_counter() - started)
+        with _warming_lock:
+            if _warming['generation'] == generation:
+                _warming['thread'] = None
+                return
+
+
+def start_warming(first_date=None, last_date=None):
+    '''
+        precompute the hot views on a background thread, or start the running one over;
+        takes the on_refresh listener arguments, so it can follow invalidate_dates
+    '''
+    if not WARM_ENABLED:
+        return
+    with _warming_lock:
+        _warming['generation'] += 1
+        if _warming['thread'] is None:
+            _warming['thread'] = threading.Thread(target=_warm_views, name='cache-warmer', daemon=True)
+            _warming['thread'].start()
@@ -0,0 +1,332 @@
+import gzip
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+from plotly.utils import PlotlyJSONEncoder
+
+# Configuration, read from the environment so every gunicorn worker agrees
+
+CACHE_BACKEND = os.environ.get('CALLBACK_CACHE', 'memory')  # memory, disk or off
+CACHE_DIR = os.environ.get('CALLBACK_CACHE_DIR', './data/cache/callbacks')
+CACHE_MAX_ENTRIES = int(os.environ.get('CALLBACK_CACHE_MAX_ENTRIES', 512))
+CACHE_MAX_BYTES = int(os.environ.get('CALLBACK_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+CACHE_TTL = float(os.environ.get('CALLBACK_CACHE_TTL', 24 * 3600))
+
+_MIDNIGHT = re.compile(r'^(\d{4}-\d{2}-\d{2})[T ]00:00:00(\.0+)?$')
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def _key_touches(key, first_date, last_date):
+    '''
+        whether the dates a cache key was made from overlap the given date range
+    '''
+    span = key.rpartition('.')[2]
+    if '_' not in span:
+        return False
+    key_first, key_last = span.split('_')
+    return key_first <= last_date and key_last >= first_date
+
+
+class MemoryBackend:
+    '''
+        in-process LRU, bounded by entry count and pickled size, entries expire after ttl seconds
+    '''
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (created, size, value)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if time.time() - entry[0] > self.ttl:
+                self._drop(key)
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[2]
+
+    def set(self, key, value):
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.time(), size, value)
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def invalidate(self, first_date, last_date):
+        with self.lock:
+            for key in [key for key in self.entries if _key_touches(key, first_date, last_date)]:
+                self._drop(key)
+
+    def _drop(self, key):
+        created, size, value = self.entries.pop(key)
+        self.total_bytes -= size
+
+
+class DiskBackend:
+    '''
+        one pickle file per entry in a directory shared by all workers of the host,
+        least recently used files are removed once the directory exceeds max_bytes
+    '''
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                created, value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        if time.time() - created > self.ttl:
+            self._remove(path)
+            return False, None
+        # the file mtime tracks the last use, for LRU eviction
+        os.utime(path)
+        return True, value
+
+    def set(self, key, value):
+        payload = pickle.dumps((time.time(), value), protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(payload)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                self._remove(entry.path)
+
+    def invalidate(self, first_date, last_date):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl') and _key_touches(entry.name[:-len('.pkl')], first_date, last_date):
+                self._remove(entry.path)
+
+    def _evict(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _make_backend(kind):
+    if kind == 'disk':
+        return DiskBackend()
+    if kind == 'memory':
+        return MemoryBackend()
+    return None
+
+
+backend = _make_backend(CACHE_BACKEND)
+
+# memoized callbacks by name, those whose outputs can also be fetched as pre-encoded JSON
+# and the checks of the inputs such a fetch may send
+_callbacks = {}
+_json_callbacks = {}
+_input_checks = {}
+
+# hit and miss counters per memoized callback
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(name, outcome):
+    with _stats_lock:
+        counters = _stats.setdefault(name, {'hits': 0, 'misses': 0})
+        counters[outcome] += 1
+
+
+def cache_stats():
+    '''
+        hit and miss counters of every memoized callback
+    '''
+    with _stats_lock:
+        return {name: dict(counters) for name, counters in _stats.items()}
+
+
+def normalize_input(value):
+    '''
+        canonical form of a callback input, so equivalent inputs share a cache entry
+    '''
+    if isinstance(value, str):
+        match = _MIDNIGHT.match(value)
+        return match.group(1) if match else value
+    if isinstance(value, dict):
+        return {key: normalize_input(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(item) for item in value]
+    return value
+
+
+def _input_dates(value):
+    if isinstance(value, str):
+        match = _DATE.match(value)
+        return [match.group(0)] if match else []
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [date for item in value for date in _input_dates(item)]
+    return []
+
+
+def cache_key(name, args):
+    '''
+        hash of the normalized inputs, followed by the first and last date among them
+        so entries of ingested dates can be found without reading them
+    '''
+    inputs = normalize_input(list(args))
+    payload = json.dumps([name, inputs], sort_keys=True, default=str)
+    dates = _input_dates(inputs)
+    span = f'{min(dates)}_{max(dates)}' if dates else 'undated'
+    return f'{hashlib.sha256(payload.encode()).hexdigest()}.{span}'
+
+
+def invalidate_dates(first_date=None, last_date=None):
+    '''
+        drop the cached outputs whose inputs include a date range overlapping
+        first_date..last_date, or every output when no dates are given
+    '''
+    if backend is None:
+        return
+    if first_date is None or last_date is None:
+        backend.clear()
+    else:
+        backend.invalidate(first_date, last_date)
+
+
+def is_date(value):
+    '''
+        whether a callback input is a date picker value: a valid YYYY-MM-DD date,
+        alone or followed by the midnight time the date picker may add
+    '''
+    if not isinstance(value, str) or not _DATE.match(value) or not (len(value) == 10 or _MIDNIGHT.match(value)):
+        return False
+    try:
+        date.fromisoformat(value[:10])
+    except ValueError:
+        return False
+    return True
+
+
+def memoize(name, serve_json=False, check_inputs=None):
+    '''
+        decorator caching a callback's output by its normalized inputs,
+        with serve_json the output is also available through output_json
+        for the inputs check_inputs does not raise ValueError on
+    '''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args):
+            if backend is None:
+                return function(*args)
+            key = cache_key(name, args)
+            found, value = backend.get(key)
+            if found:
+                _count(name, 'hits')
+                return value
+            _count(name, 'misses')
+            value = function(*args)
+            backend.set(key, value)
+            return value
+        _callbacks[name] = wrapper
+        if serve_json:
+            _json_callbacks[name] = wrapper
+            _input_checks[name] = check_inputs
+        return wrapper
+    return decorator
+
+
+def serves_json(name):
+    return name in _json_callbacks
+
+
+def check_json_inputs(name, args):
+    '''
+        raise TypeError or ValueError when args are not inputs output_json can run the callback on
+    '''
+    check = _input_checks.get(name)
+    if not isinstance(args, list):
+        raise TypeError('inputs must be a list')
+    if check is not None:
+        check(*args)
+
+
+def output_json(name, args):
+    '''
+        etag and gzip-compressed JSON of a memoized callback's output, encoded once per input
+    '''
+    function = _json_callbacks[name]
+    key = cache_key('json:' + name, args)
+    if backend is not None:
+        found, entry = backend.get(key)
+        if found:
+            _count('json:' + name, 'hits')
+            return entry
+        _count('json:' + name, 'misses')
+
+    # the figure itself is not cached as well, the page only ever asks for its JSON
+    body = json.dumps(function.__wrapped__(*args), cls=PlotlyJSONEncoder, separators=(',', ':')).encode()
+    entry = (hashlib.sha256(body).hexdigest()[:32], gzip.compress(body, compresslevel=6))
+    if backend is not None:
+        backend.set(key, entry)
+    return entry
+
+
+def warm(name, args):
+    '''
+        compute and cache a memoized callback's output for args, only its JSON when it serves one
+    '''
+    if serves_json(name):
+        output_json(name, args)
+    else:
+        _callbacks[name](*args)
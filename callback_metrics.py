@@ -0,0 +1,175 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from dash import _callback
+from dash.exceptions import PreventUpdate
+from callback_cache import cache_stats
+
+# Configuration, read from the environment like callback_cache's.
+# Counters are kept per worker process, like the callback cache.
+
+# Upper bounds of the callback duration histogram, in seconds
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# cProfile dumps of callbacks slower than PROFILE_SECONDS, 0 disables profiling;
+# only a PROFILE_SAMPLE share of the calls runs under the profiler
+PROFILE_SECONDS = float(os.environ.get('CALLBACK_PROFILE_SECONDS', 0))
+PROFILE_SAMPLE = float(os.environ.get('CALLBACK_PROFILE_SAMPLE', 1))
+PROFILE_DIR = os.environ.get('CALLBACK_PROFILE_DIR', './data/profiles')
+
+# per callback: calls, errors, duration histogram, stage seconds, payload bytes and rows
+_metrics = {}
+_metrics_lock = threading.Lock()
+_current = threading.local()
+
+
+@contextmanager
+def stage(name):
+    '''
+        add the time spent in the block to the stage of the running callback
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = getattr(_current, 'stages', None)
+        if stages is not None:
+            stages[name] = stages.get(name, 0) + time.perf_counter() - start
+
+
+def record_rows(count):
+    '''
+        add count to the data rows the running callback worked on
+    '''
+    if getattr(_current, 'stages', None) is not None:
+        _current.rows += count
+
+
+def _record(name, elapsed, stages, payload_bytes, rows, failed):
+    with _metrics_lock:
+        metrics = _metrics.setdefault(name, {
+            'calls': 0, 'errors': 0, 'seconds': 0.0, 'buckets': [0] * len(DURATION_BUCKETS),
+            'stages': {}, 'payload_bytes': 0, 'rows': 0,
+        })
+        metrics['calls'] += 1
+        metrics['errors'] += failed
+        metrics['seconds'] += elapsed
+        for position, bound in enumerate(DURATION_BUCKETS):
+            if elapsed <= bound:
+                metrics['buckets'][position] += 1
+        for stage_name, seconds in stages.items():
+            metrics['stages'][stage_name] = metrics['stages'].get(stage_name, 0) + seconds
+        metrics['payload_bytes'] += payload_bytes
+        metrics['rows'] += rows
+
+
+def _dump_profile(profile, name, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{elapsed * 1000:.0f}ms-{os.getpid()}.prof')
+    profile.dump_stats(path)
+
+
+def _response_size(response):
+    return len(response.encode() if isinstance(response, str) else response)
+
+
+def instrument(name, dispatch, payload_size=_response_size):
+    '''
+        dispatch, the Dash function running a callback and encoding its output, with timings;
+        also used for callback outputs served by other routes, whose payload_size may differ
+    '''
+    @wraps(dispatch)
+    def wrapper(*args, **kwargs):
+        _current.stages, _current.rows = {}, 0
+        profile = None
+        if PROFILE_SECONDS > 0 and random.random() < PROFILE_SAMPLE:
+            profile = cProfile.Profile()
+        failed, payload_bytes = False, 0
+        start = time.perf_counter()
+        try:
+            if profile is not None:
+                profile.enable()
+            response = dispatch(*args, **kwargs)
+            payload_bytes = payload_size(response)
+            return response
+        except PreventUpdate:
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                if elapsed >= PROFILE_SECONDS:
+                    _dump_profile(profile, name, elapsed)
+            stages = _current.stages
+            # what the callback's stages do not cover: cache lookups, Dash's dispatch and JSON encoding
+            stages['serialize'] = max(elapsed - sum(stages.values()), 0)
+            _record(name, elapsed, stages, payload_bytes, _current.rows, failed)
+            _current.stages = None
+    return wrapper
+
+
+def instrument_callbacks():
+    '''
+        time every callback registered with dash.callback so far, run once the pages are imported
+    '''
+    for entry in _callback.GLOBAL_CALLBACK_MAP.values():
+        # clientside callbacks run in the browser and have no function here
+        dispatch = entry.get('callback')
+        if dispatch is not None and not getattr(dispatch, 'instrumented', False):
+            entry['callback'] = instrument(dispatch.__name__, dispatch)
+            entry['callback'].instrumented = True
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+def prometheus_text():
+    '''
+        callback metrics and callback cache counters in the Prometheus text exposition format
+    '''
+    with _metrics_lock:
+        metrics = {name: {**values, 'buckets': list(values['buckets']), 'stages': dict(values['stages'])} for name, values in _metrics.items()}
+
+    lines = [
+        '# HELP dash_callback_duration_seconds Time to run a callback and encode its output.',
+        '# TYPE dash_callback_duration_seconds histogram',
+    ]
+    for name, values in metrics.items():
+        for bound, count in zip(DURATION_BUCKETS, values['buckets']):
+            lines.append(f'dash_callback_duration_seconds_bucket{_labels(callback=name, le=bound)} {count}')
+        lines.append(f'dash_callback_duration_seconds_bucket{_labels(callback=name, le="+Inf")} {values["calls"]}')
+        lines.append(f'dash_callback_duration_seconds_sum{_labels(callback=name)} {values["seconds"]}')
+        lines.append(f'dash_callback_duration_seconds_count{_labels(callback=name)} {values["calls"]}')
+
+    lines += [
+        '# HELP dash_callback_stage_seconds_total Time spent per callback stage.',
+        '# TYPE dash_callback_stage_seconds_total counter',
+    ]
+    for name, values in metrics.items():
+        for stage_name, seconds in values['stages'].items():
+            lines.append(f'dash_callback_stage_seconds_total{_labels(callback=name, stage=stage_name)} {seconds}')
+
+    for metric, key, description in [
+        ('dash_callback_errors_total', 'errors', 'Callbacks that raised an exception.'),
+        ('dash_callback_payload_bytes_total', 'payload_bytes', 'Bytes of encoded callback responses.'),
+        ('dash_callback_rows_total', 'rows', 'Data rows the callbacks worked on.'),
+    ]:
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+        lines += [f'{metric}{_labels(callback=name)} {values[key]}' for name, values in metrics.items()]
+
+    lines += [
+        '# HELP dash_callback_cache_total Callback cache lookups.',
+        '# TYPE dash_callback_cache_total counter',
+    ]
+    for name, counters in cache_stats().items():
+        for outcome, count in counters.items():
+            lines.append(f'dash_callback_cache_total{_labels(callback=name, outcome=outcome)} {count}')
+    return '\n'.join(lines) + '\n'
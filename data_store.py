@@ -0,0 +1,1524 @@
+import fcntl
+import hashlib
+import json
+import logging
+import math
+import operator
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+# Data Sources
+
+CHART_PATH = './data/universal_top_songs_final.csv'
+ENAO_PATH = './data/enao.csv'
+
+# Columnar copy of the chart table, rebuilt whenever the CSV changes. Every data version is a
+# directory of VERSIONS_DIR that is never modified: columns/ holds one .npy file per column,
+# ingested days included, mapped read-only so every worker of a host shares a single copy
+# through the page cache, dictionaries/ the categories of the string columns and segments/
+# the ingested days once more, to merge them into the columns of a rebuild.
+# The metadata file names the current version, a state keeps reading the one it started with.
+CACHE_DIR = './data/cache'
+VERSIONS_DIR = os.path.join(CACHE_DIR, 'versions')
+CHART_CACHE_META_PATH = os.path.join(CACHE_DIR, 'universal_top_songs_final.json')
+# flock'ed while the cache is built or appended to, so the workers of a host build it once
+CACHE_LOCK_PATH = os.path.join(CACHE_DIR, 'build.lock')
+
+# The cache is built from the CSV in chunks, spilling rows to per-(country, month) partitions
+# that hold dictionary codes of the dictionaries of the latest build
+CHART_CHUNK_ROWS = int(os.environ.get('CHART_CHUNK_ROWS', 100_000))
+CHART_SPILL_ROWS = int(os.environ.get('CHART_SPILL_ROWS', 500_000))
+PARTITIONS_DIR = os.path.join(CACHE_DIR, 'partitions')
+
+# Bumped whenever the cached dtypes or files change, so stale caches get rebuilt
+CACHE_VERSION = 6
+
+# Compact dtypes of the cached chart table, other string columns become categoricals too
+CATEGORY_COLUMNS = ['spotify_id', 'track_name', 'artists', 'country', 'country_name']
+DATE_COLUMNS = ['snapshot_date']
+SMALL_INT_COLUMNS = ['daily_rank', 'daily_movement', 'weekly_movement', 'popularity']
+
+# Columns each page reads from the chart table, the shared table holds their union
+RANKING_COLUMNS = ['spotify_id', 'track_name', 'artists', 'snapshot_date', 'country_name', 'country', 'daily_movement', 'daily_rank', 'album_release_date']
+GENRES_COLUMNS = ['spotify_id', 'track_name', 'artists', 'snapshot_date', 'genres', 'country_name', 'country']
+CHART_COLUMNS = list(dict.fromkeys(RANKING_COLUMNS + GENRES_COLUMNS))
+
+# Threads computing per-country genre counts concurrently, 1 computes them serially
+GENRE_WORKERS = int(os.environ.get('GENRE_WORKERS', min(8, os.cpu_count() or 1)))
+
+# Engine of the bump chart and genre-space queries: 'pandas' runs them with NumPy over the
+# loaded columns, 'duckdb' as SQL over the same columns (needs the duckdb package)
+QUERY_BACKEND = os.environ.get('QUERY_BACKEND', 'pandas')
+
+# Seconds between checks for newly ingested days, 0 disables the checks
+DATA_REFRESH_SECONDS = float(os.environ.get('DATA_REFRESH_SECONDS', 60))
+
+logger = logging.getLogger(__name__)
+
+# Loaded datasets of the current data version, shared by every page of the worker.
+# A replaced state is never modified again, so a callback holding one sees a single version.
+_state = None
+_state_lock = threading.RLock()
+
+
+def _shared(state, name, loader):
+    '''
+        return the dataset stored under name, calling loader the first time it is needed
+    '''
+    value = state.get(name)
+    if value is None:
+        with _state_lock:
+            value = state.get(name)
+            if value is None:
+                value = loader()
+                state[name] = value
+    return value
+
+
+def _file_hash(path):
+    '''
+        sha256 of a file, read in 1 MB blocks
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _write_json(path, value):
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(value, file)
+    os.replace(tmp_path, path)
+
+
+_cache_lock = {'lock': threading.RLock(), 'file': None, 'depth': 0}
+
+
+@contextmanager
+def cache_lock():
+    '''
+        hold the cache directory's file lock, taken by one process of the host at a time
+        and re-entrant within it
+    '''
+    with _cache_lock['lock']:
+        if _cache_lock['depth'] == 0:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            lock_file = open(CACHE_LOCK_PATH, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _cache_lock['file'] = lock_file
+        _cache_lock['depth'] += 1
+        try:
+            yield
+        finally:
+            _cache_lock['depth'] -= 1
+            if _cache_lock['depth'] == 0:
+                # closing the file releases the lock
+                _cache_lock['file'].close()
+                _cache_lock['file'] = None
+
+
+def _replace_dir(source, target):
+    '''
+        move the directory source to target, replacing the previous target
+    '''
+    old = None
+    if os.path.isdir(target):
+        old = tempfile.mkdtemp(prefix=os.path.basename(target) + '.old.', dir=os.path.dirname(target))
+        os.replace(target, os.path.join(old, 'replaced'))
+    os.replace(source, target)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _version_path(meta, *names):
+    return os.path.join(VERSIONS_DIR, meta['path'], *names)
+
+
+class _Lease:
+    '''
+        shared lock on a data version directory, which is not removed while any process holds
+        one; states keep theirs until they are garbage collected
+    '''
+
+    def __init__(self, file):
+        self.file = file
+
+    def __del__(self):
+        self.file.close()
+
+
+def _lease(meta):
+    '''
+        a lease on the data version meta describes, None when the version was removed meanwhile
+    '''
+    try:
+        file = open(_version_path(meta, 'lease'), 'rb')
+    except FileNotFoundError:
+        return None
+    fcntl.flock(file, fcntl.LOCK_SH)
+    # removed versions are moved away before they are deleted
+    if not os.path.isdir(_version_path(meta)):
+        file.close()
+        return None
+    return _Lease(file)
+
+
+def _collect_versions(current):
+    '''
+        delete the data versions other than current that no process holds a lease on,
+        and the directories of interrupted builds; called with the cache lock held
+    '''
+    for entry in os.scandir(VERSIONS_DIR):
+        if entry.name == current or not entry.is_dir():
+            continue
+        path = entry.path
+        if not entry.name.startswith('tmp.'):
+            try:
+                with open(os.path.join(path, 'lease'), 'rb') as lease:
+                    fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    # moved away before deleting, so a process taking a lease meanwhile sees it gone
+                    path = tempfile.mkdtemp(prefix='tmp.', dir=VERSIONS_DIR)
+                    os.replace(entry.path, os.path.join(path, entry.name))
+            except (BlockingIOError, FileNotFoundError):
+                continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _link(source, target):
+    '''
+        hard link target to the file source, or copy it where links are not supported
+    '''
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _link_tree(source, target):
+    '''
+        hard links in target to the files under source, which a data version shares with the
+        previous one
+    '''
+    for directory, _, names in os.walk(source):
+        target_dir = os.path.join(target, os.path.relpath(directory, source))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in names:
+            _link(os.path.join(directory, name), os.path.join(target_dir, name))
+
+
+def _publish(build_dir, meta):
+    '''
+        move a complete data version in place and make it the current one, then delete the
+        versions no process reads anymore; called with the cache lock held
+    '''
+    meta = {**meta, 'path': f"{meta['build']}.{meta['data_version']:06d}"}
+    open(os.path.join(build_dir, 'lease'), 'w').close()
+    os.replace(build_dir, _version_path(meta))
+    _write_json(CHART_CACHE_META_PATH, meta)
+    _collect_versions(meta['path'])
+    return meta
+
+
+def read_chart_csv(source, **kwargs):
+    '''
+        read a chart CSV with dictionary-encoded string columns and parsed dates
+    '''
+    return pd.read_csv(source, dtype={col: 'category' for col in CATEGORY_COLUMNS}, parse_dates=DATE_COLUMNS, **kwargs)
+
+
+def normalize_chart(chart):
+    '''
+        compact dtypes of the chart rows, sorted by (country, date) so a country's
+        date range is one contiguous slice
+    '''
+    for col in chart.columns:
+        if col in SMALL_INT_COLUMNS:
+            # stays float when the column has missing values
+            chart[col] = pd.to_numeric(chart[col], downcast='integer')
+        elif chart[col].dtype == object:
+            chart[col] = chart[col].astype('category')
+
+    order = np.lexsort((chart['snapshot_date'].values, chart['country_name'].cat.codes.values))
+    return chart.take(order).reset_index(drop=True)
+
+
+class _Dictionary:
+    '''
+        codes of the distinct values of a string column, in order of first appearance
+    '''
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def add(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, column):
+        chunk_codes, uniques = pd.factorize(column)
+        if len(uniques) == 0:
+            return np.full(len(column), -1, dtype=np.int32)
+        lookup = np.array([self.add(value) for value in uniques], dtype=np.int32)
+        return np.where(chunk_codes >= 0, lookup[chunk_codes], -1).astype(np.int32)
+
+    def sort(self):
+        '''
+            the values in sorted order, like pandas categories, and the new code of every code
+        '''
+        order = np.argsort(np.array(self.values, dtype=object), kind='stable')
+        remap = np.empty(len(order), dtype=np.int32)
+        remap[order] = np.arange(len(order))
+        return [self.values[code] for code in order], remap
+
+
+def _codes_dtype(n_values):
+    '''
+        smallest codes dtype, the one pandas gives a categorical with n_values categories
+    '''
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_values < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _numeric_dtype(col, dtypes, low, high):
+    '''
+        dtype of a numeric column over all chunks, small int columns downcast like pd.to_numeric
+    '''
+    dtype = np.result_type(*dtypes)
+    if col in SMALL_INT_COLUMNS and dtype.kind == 'i':
+        for candidate in (np.int8, np.int16, np.int32):
+            if np.iinfo(candidate).min <= low and high <= np.iinfo(candidate).max:
+                return np.dtype(candidate)
+    return dtype
+
+
+def _partition_dir(root, country_name, month):
+    name = '__null__' if country_name is None else quote(str(country_name), safe='')
+    return os.path.join(root, f'country_name={name}', f'month={np.int64(month).astype("datetime64[M]")}')
+
+
+def _write_part(path, columns):
+    feather.write_feather(pa.table(columns), path, compression='uncompressed')
+
+
+def _read_part(path):
+    table = feather.read_table(path)
+    return {col: table.column(col).to_numpy() for col in table.column_names}
+
+
+def _spill(root, buffers, part_counts, countries):
+    '''
+        write the buffered rows of every (country, month) partition to a new part file under root
+    '''
+    for (country_code, month), parts in buffers.items():
+        directory = _partition_dir(root, countries.values[country_code] if country_code >= 0 else None, month)
+        os.makedirs(directory, exist_ok=True)
+        number = part_counts.get((country_code, month), 0)
+        _write_part(os.path.join(directory, f'part-{number:05d}.feather'), {col: np.concatenate([part[col] for part in parts]) for col in parts[0]})
+        part_counts[(country_code, month)] = number + 1
+    buffers.clear()
+
+
+def _split_genres(genres):
+    '''
+        CSR lists of genre token ids of every genres string, and the tokens
+    '''
+    tokens = _Dictionary()
+    offsets = [0]
+    token_ids = []
+    for track_genres in genres:
+        token_ids.extend(tokens.add(genre) for genre in track_genres.split(', '))
+        offsets.append(len(token_ids))
+    return np.array(offsets, dtype=np.int64), np.array(token_ids, dtype=np.int64), np.array(tokens.values, dtype=str)
+
+
+def build_chart_cache(source=CHART_PATH):
+    '''
+        convert the chart CSV into a new data version with dictionary-encoded string columns.
+        The segments ingested on top of the previous version are kept when the CSV is the same
+        one, e.g. after a CACHE_VERSION bump, and dropped when it changed.
+
+        The CSV is streamed in chunks of CHART_CHUNK_ROWS: string columns are encoded as they
+        arrive and rows are spilled to per-(country, month) partitions, which are then sorted
+        and copied into the column files one at a time, so memory stays bounded by the chunk
+        and spill sizes plus the distinct strings.
+    '''
+    with cache_lock():
+        os.makedirs(VERSIONS_DIR, exist_ok=True)
+        build_dir = tempfile.mkdtemp(prefix='tmp.', dir=VERSIONS_DIR)
+        try:
+            return _build_chart_cache(source, build_dir)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def _build_chart_cache(source, build_dir):
+    sample = pd.read_csv(source, nrows=CHART_CHUNK_ROWS, parse_dates=DATE_COLUMNS)
+    columns = list(sample.columns)
+    string_columns = [col for col in columns if col in CATEGORY_COLUMNS or (sample[col].dtype == object and col not in DATE_COLUMNS)]
+    dictionaries = {col: _Dictionary() for col in string_columns}
+    numeric = {col: {'dtypes': [], 'low': 0, 'high': 0} for col in columns if col not in string_columns and col not in DATE_COLUMNS}
+    del sample
+
+    # a rebuild of the same CSV, e.g. after a CACHE_VERSION bump, merges its ingested days in again
+    sha256 = _file_hash(source)
+    previous, segments_dir = _previous_segments()
+    carried = previous is not None and previous['sha256'] == sha256
+    base_dir = os.path.join(build_dir, 'base') if carried else build_dir
+
+    partitions_dir, columns_dir = os.path.join(build_dir, 'partitions'), os.path.join(base_dir, 'columns')
+    buffers, part_counts, buffered, n_rows = {}, {}, 0, 0
+    chunks = pd.read_csv(source, chunksize=CHART_CHUNK_ROWS, dtype={col: str for col in string_columns}, parse_dates=DATE_COLUMNS)
+    for chunk in chunks:
+        encoded = {}
+        for col in columns:
+            if col in dictionaries:
+                encoded[col] = dictionaries[col].encode(chunk[col])
+                continue
+            values = chunk[col].to_numpy()
+            if col in numeric:
+                if values.dtype == object:
+                    raise ValueError(f'{col} has text values after the first {CHART_CHUNK_ROWS} rows, which were numeric')
+                stats = numeric[col]
+                stats['dtypes'].append(values.dtype)
+                if len(values) and values.dtype.kind in 'iuf' and not np.isnan(values.astype(np.float64)).all():
+                    stats['low'] = min(stats['low'], np.nanmin(values))
+                    stats['high'] = max(stats['high'], np.nanmax(values))
+            encoded[col] = values
+        # rows of each (country, month) in file order, as slices of the chunk sorted by partition
+        country_codes = encoded['country_name']
+        months = chunk['snapshot_date'].to_numpy().astype('datetime64[M]').astype(np.int64)
+        order = np.lexsort((months, country_codes))
+        country_codes, months = country_codes[order], months[order]
+        encoded = {col: values[order] for col, values in encoded.items()}
+        starts = np.flatnonzero(np.diff(country_codes, prepend=-2) | np.diff(months, prepend=months[:1] - 1))
+        for start, stop in zip(starts, np.append(starts[1:], len(order))):
+            key = (int(country_codes[start]), int(months[start]))
+            buffers.setdefault(key, []).append({col: values[start:stop] for col, values in encoded.items()})
+        buffered += len(order)
+        n_rows += len(order)
+        if buffered >= CHART_SPILL_ROWS:
+            _spill(partitions_dir, buffers, part_counts, dictionaries['country_name'])
+            buffered = 0
+    _spill(partitions_dir, buffers, part_counts, dictionaries['country_name'])
+
+    # final dictionaries are sorted like pandas categories
+    sorted_values, remaps = {}, {}
+    for col, dictionary in dictionaries.items():
+        sorted_values[col], remaps[col] = dictionary.sort()
+    dtypes = {col: _numeric_dtype(col, stats['dtypes'], stats['low'], stats['high']) for col, stats in numeric.items()}
+    dtypes.update({col: _codes_dtype(len(sorted_values[col])) for col in dictionaries})
+    dtypes.update({col: np.dtype('datetime64[ns]') for col in columns if col not in dtypes})
+
+    # one preallocated .npy file per column, filled one partition at a time
+    os.makedirs(columns_dir)
+    column_files = {col: np.lib.format.open_memmap(os.path.join(columns_dir, f'{col}.npy'), mode='w+', dtype=dtypes[col], shape=(n_rows,)) for col in columns}
+
+    # partitions in (country, month) order give the (country, date) order of the whole table
+    country_ranks = np.append(remaps['country_name'], -1)
+    partitions = sorted(part_counts, key=lambda key: (country_ranks[key[0]], key[1]))
+    position = 0
+    for country_code, month in partitions:
+        directory = _partition_dir(partitions_dir, dictionaries['country_name'].values[country_code] if country_code >= 0 else None, month)
+        paths = [os.path.join(directory, f'part-{number:05d}.feather') for number in range(part_counts[(country_code, month)])]
+        parts = [_read_part(path) for path in paths]
+        order = np.argsort(np.concatenate([part['snapshot_date'] for part in parts]), kind='stable')
+        part = {col: np.concatenate([part[col] for part in parts])[order] for col in columns}
+        for col in dictionaries:
+            codes = part[col]
+            part[col] = np.where(codes >= 0, remaps[col][codes], -1).astype(np.int32)
+
+        # partitions keep plain codes of the dictionaries written next to them
+        for path in paths:
+            os.remove(path)
+        _write_part(os.path.join(directory, 'part.feather'), part)
+
+        end = position + len(order)
+        for col in columns:
+            column_files[col][position:end] = part[col]
+        position = end
+    last_date = column_files['snapshot_date'].max() if n_rows else None
+    for column_file in column_files.values():
+        column_file.flush()
+    del column_files
+    if os.path.isdir(partitions_dir):
+        _replace_dir(partitions_dir, PARTITIONS_DIR)
+
+    os.makedirs(os.path.join(base_dir, 'dictionaries'))
+    for col, values in sorted_values.items():
+        _write_dictionary(base_dir, col, values)
+
+    meta = {'version': CACHE_VERSION, **_source_stamp(source), 'sha256': sha256, 'build': f'{sha256[:12]}-{secrets.token_hex(4)}',
+            'columns': columns, 'rows': n_rows, 'dictionaries': string_columns, 'data_version': 0, 'segments': []}
+    if 'genres' in sorted_values:
+        # genres strings split into genre tokens once, for the genre index of every worker
+        offsets, token_ids, tokens = _split_genres(sorted_values['genres'])
+        np.savez(os.path.join(build_dir, 'genres_split.npz'), offsets=offsets, token_ids=token_ids, tokens=tokens, sha256=np.array(sha256))
+
+    if carried:
+        _link_tree(segments_dir, os.path.join(build_dir, 'segments'))
+        segments = [pd.read_feather(os.path.join(segments_dir, segment['path'])) for segment in previous['segments']]
+        meta.update(rows=_merge_segments(meta, base_dir, build_dir, segments), data_version=previous['data_version'], segments=previous['segments'])
+        shutil.rmtree(base_dir)
+    elif previous is not None and last_date is not None:
+        missing = [segment for segment in previous['segments'] if segment['last_date'] > str(last_date)[:10]]
+        if missing:
+            logger.warning('the rebuilt chart cache ends on %s, the days ingested up to %s are not in %s and were dropped',
+                           str(last_date)[:10], missing[-1]['last_date'], source)
+    return _publish(build_dir, meta)
+
+
+def _previous_segments():
+    '''
+        metadata of the current data version and the directory of its segments, if it has any
+    '''
+    previous = _read_meta()
+    if previous is not None and 'segments' in previous:
+        return (previous, _version_path(previous, 'segments')) if previous['segments'] else (None, None)
+    try:
+        # caches of CACHE_VERSION 5 listed their segments in segments.json
+        with open(os.path.join(CACHE_DIR, 'segments.json')) as file:
+            manifest = json.load(file)
+        return {'sha256': manifest['base_sha256'], 'data_version': manifest['version'], 'segments': manifest['segments']}, os.path.join(CACHE_DIR, 'segments')
+    except (OSError, ValueError, KeyError):
+        return None, None
+
+
+def _read_meta():
+    try:
+        with open(CHART_CACHE_META_PATH) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _current_meta(source, locked=False):
+    '''
+        metadata of the current data version if it matches the CSV by mtime and size,
+        or else by hash when the cache lock is held
+    '''
+    meta = _read_meta()
+    if meta is None or meta.get('version') != CACHE_VERSION or not os.path.exists(_version_path(meta, 'lease')):
+        return None
+
+    stamp = _source_stamp(source)
+    if stamp['mtime_ns'] == meta['mtime_ns'] and stamp['size'] == meta['size']:
+        return meta
+    if locked and stamp['size'] == meta['size'] and _file_hash(source) == meta['sha256']:
+        # touched but unchanged, remember the new mtime so the hash is not computed again
+        meta.update(stamp)
+        _write_json(CHART_CACHE_META_PATH, meta)
+        return meta
+    return None
+
+
+def ensure_chart_cache(source=CHART_PATH):
+    '''
+        rebuild the cache unless its current data version matches the CSV
+    '''
+    meta = _current_meta(source)
+    if meta is not None:
+        return meta
+    with cache_lock():
+        # another worker may have built it while this one waited for the lock
+        return _current_meta(source, locked=True) or build_chart_cache(source)
+
+
+def _read_dictionary(directory, col):
+    return pd.Index(pd.read_feather(os.path.join(directory, 'dictionaries', f'{col}.feather'))['value'].to_numpy())
+
+
+def _write_dictionary(directory, col, values):
+    pd.DataFrame({'value': pd.Series(values, dtype=object)}).to_feather(os.path.join(directory, 'dictionaries', f'{col}.feather'))
+
+
+def _map_column(directory, col, rows):
+    # plain ndarray views of the memmap, so results computed from them are not memmaps
+    return np.asarray(np.load(os.path.join(directory, 'columns', f'{col}.npy'), mmap_mode='r' if rows else None))
+
+
+def read_chart(columns, meta=None):
+    '''
+        the given columns of the data version meta describes, the current one by default,
+        mapped read-only from their column files
+    '''
+    meta = meta or ensure_chart_cache()
+    directory = _version_path(meta)
+    chart = {}
+    for col in columns:
+        values = _map_column(directory, col, meta['rows'])
+        if col in meta['dictionaries']:
+            values = pd.Categorical.from_codes(values, categories=_read_dictionary(directory, col))
+        chart[col] = values
+    # one block per column, consolidating same-dtype columns would copy the mapped data
+    return pd.DataFrame(chart, copy=False)
+
+
+def _merge_segments(meta, source, target, segments):
+    '''
+        write the columns and dictionaries in source, of the table meta describes, to target
+        with the rows of the (country, date) sorted segments merged in, one column at a time,
+        and return the number of rows. Each country's rows stay contiguous and in segment
+        order; categories first seen in segments are appended, so the codes of earlier rows
+        never change
+    '''
+    os.makedirs(os.path.join(target, 'columns'))
+    os.makedirs(os.path.join(target, 'dictionaries'))
+    segment_rows = sum(len(segment) for segment in segments)
+    rows = meta['rows'] + segment_rows
+    blocks = None
+    for col in ['country_name'] + [col for col in meta['columns'] if col != 'country_name']:
+        base = _map_column(source, col, meta['rows'])
+        values = [segment[col] for segment in segments]
+        if col in meta['dictionaries']:
+            values = [value if isinstance(value.dtype, pd.CategoricalDtype) else value.astype('category') for value in values]
+            categories = _read_dictionary(source, col)
+            for value in values:
+                categories = categories.append(value.cat.categories.difference(categories))
+            codes = []
+            for value in values:
+                recode = categories.get_indexer(value.cat.categories)
+                value_codes = value.cat.codes.to_numpy()
+                codes.append(np.where(value_codes >= 0, recode[value_codes], -1))
+            added = np.concatenate(codes) if codes else np.array([], dtype=np.int32)
+            dtype = _codes_dtype(len(categories))
+            _write_dictionary(target, col, categories)
+        else:
+            added = np.concatenate([value.to_numpy() for value in values]) if values else base[:0]
+            dtype = np.result_type(base.dtype, added.dtype)
+
+        if blocks is None:
+            # every country's base rows followed by its segment rows, country codes -1 first
+            order = np.argsort(added, kind='stable')
+            groups = np.arange(-1, len(categories) + 1)
+            blocks = list(zip(np.searchsorted(base, groups), np.searchsorted(added[order], groups)))
+        added = added[order]
+
+        column_file = np.lib.format.open_memmap(os.path.join(target, 'columns', f'{col}.npy'), mode='w+', dtype=dtype, shape=(rows,))
+        position = 0
+        for (base_start, added_start), (base_end, added_end) in zip(blocks, blocks[1:]):
+            column_file[position:position + base_end - base_start] = base[base_start:base_end]
+            position += base_end - base_start
+            column_file[position:position + added_end - added_start] = added[added_start:added_end]
+            position += added_end - added_start
+        column_file.flush()
+        del column_file
+    return rows
+
+
+def _new_state(meta=None):
+    '''
+        empty state of the data version meta describes, the current one by default; its columns
+        are all read from that version, which is kept on disk while the state is referenced
+    '''
+    while True:
+        meta = meta or ensure_chart_cache()
+        lease = _lease(meta)
+        if lease is not None:
+            return {'meta': meta, 'lease': lease, 'version': meta['data_version'], 'segments': list(meta['segments'])}
+        # replaced and deleted after meta was read
+        meta = None
+
+
+def current_state():
+    '''
+        datasets of the data version loaded by the worker
+    '''
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = _new_state()
+    return _state
+
+
+def data_version():
+    '''
+        number of ingestions applied to the loaded chart table
+    '''
+    return current_state()['version']
+
+
+def _extend_chart(state, columns):
+    chart = state.get('chart')
+    missing = [col for col in columns if chart is None or col not in chart.columns]
+    if not missing:
+        return chart
+    with _state_lock:
+        chart = state.get('chart')
+        missing = [col for col in dict.fromkeys(columns) if chart is None or col not in chart.columns]
+        if missing:
+            new_columns = read_chart(missing, state['meta'])
+            # build a new frame instead of inserting columns, so readers of the old one are unaffected
+            if chart is None:
+                chart = new_columns
+            else:
+                chart = pd.concat([chart, new_columns[missing]], axis=1, copy=False)
+            state['chart'] = chart
+    return chart
+
+
+def load_chart(columns=CHART_COLUMNS, state=None):
+    '''
+        the Top 50 chart table shared by the pages, holding at least the given columns
+    '''
+    return _extend_chart(state or current_state(), columns)
+
+
+# ENAO datasets by file, read once per worker apart from the chart state, so pages drawing
+# only the genre-space never wait for the chart cache to be built
+_enao_states = {}
+
+
+def _enao_state():
+    return _enao_states.setdefault(os.path.abspath(ENAO_PATH), {})
+
+
+def load_enao():
+    '''
+        the Every Noise at Once genre coordinates
+    '''
+    return _shared(_enao_state(), 'enao', lambda: pd.read_csv(ENAO_PATH))
+
+
+# country_options and date_span are called by the page layouts on every visit,
+# so ingested countries and days show up without a restart
+def country_options(state=None):
+    '''
+        dropdown options with every country in the chart table
+    '''
+    chart = load_chart(['country', 'country_name'], state)
+    unique_countries = list(zip(chart['country'].unique(), chart['country_name'].unique()))
+    return [{'label': country_name, 'value': country_name} for country_code, country_name in unique_countries]
+
+
+def date_span(state=None):
+    '''
+        first and last snapshot dates in the chart table
+    '''
+    snapshot_date = load_chart(['snapshot_date'], state)['snapshot_date']
+    return snapshot_date.min().strftime('%Y-%m-%d'), snapshot_date.max().strftime('%Y-%m-%d')
+
+
+def _to_datetime64(date):
+    '''
+        convert a DatePickerRange or clickData date string to numpy datetime64
+    '''
+    return pd.Timestamp(date).to_datetime64()
+
+
+def _build_chart_index(state):
+    chart = load_chart(['country_name', 'snapshot_date'], state)
+    country_codes = chart['country_name'].cat.codes.values
+    countries = chart['country_name'].cat.categories
+    return {
+        'countries': countries,
+        # rows of country i are offsets[i]:offsets[i + 1]
+        'offsets': np.searchsorted(country_codes, np.arange(len(countries) + 1)),
+        'snapshot_date': chart['snapshot_date'].values,
+    }
+
+
+def chart_index(state=None):
+    '''
+        per-country row offsets of the (country, date) sorted chart table
+    '''
+    state = state or current_state()
+    return _shared(state, 'chart_index', lambda: _build_chart_index(state))
+
+
+def country_date_rows(country_name, start_date, end_date, state=None):
+    '''
+        first and past-the-end row of a country's snapshots between two dates, both inclusive
+    '''
+    index = chart_index(state)
+    if country_name not in index['countries']:
+        return 0, 0
+    country_code = index['countries'].get_loc(country_name)
+    first, last = index['offsets'][country_code], index['offsets'][country_code + 1]
+
+    # two binary searches over the country's dates
+    dates = index['snapshot_date'][first:last]
+    start = first + np.searchsorted(dates, _to_datetime64(start_date), side='left')
+    stop = first + np.searchsorted(dates, _to_datetime64(end_date), side='right')
+    return start, max(start, stop)
+
+
+def _day_numbers(dates):
+    return dates.astype('datetime64[D]').astype(np.int64)
+
+
+# The bump chart shows the TOP_TRACKS best mean ranks among the STAYING_TRACKS tracks with most days
+STAYING_TRACKS = 31
+TOP_TRACKS = 10
+
+
+def _extend_rank_matrix(matrix, song_codes, track_codes, artist_codes, days, ranks):
+    '''
+        matrix with more chart rows of its country set, or a new one when matrix is None
+    '''
+    if matrix is None:
+        matrix = {'keys': np.empty((0, 3), dtype=np.int64), 'first_day': days.min() if len(days) else 0, 'ranks': np.zeros((0, 0), dtype=np.int8),
+                  'extra_rows': np.array([], dtype=np.int64), 'extra_days': np.array([], dtype=np.int64), 'extra_ranks': np.array([], dtype=np.int8)}
+
+    # one row per (song, track, artists)
+    row_keys = np.column_stack([song_codes, track_codes, artist_codes]).astype(np.int64)
+    keys, key_rows = np.unique(np.concatenate([matrix['keys'], row_keys]), axis=0, return_inverse=True)
+    key_rows = key_rows.ravel()
+    n_old = len(matrix['keys'])
+    first_day = min(matrix['first_day'], days.min()) if len(days) else matrix['first_day']
+    last_day = max(matrix['first_day'] + matrix['ranks'].shape[1], days.max() + 1 if len(days) else 0)
+
+    ranks_by_day = np.zeros((len(keys), max(last_day - first_day, 0)), dtype=np.int8)
+    old_first = matrix['first_day'] - first_day
+    ranks_by_day[key_rows[:n_old], old_first:old_first + matrix['ranks'].shape[1]] = matrix['ranks']
+
+    # a song can chart more than once on a day of a country, every chart row counts like in
+    # the SQL summary: the first one of a (row, day) cell is in the matrix, the others are extras
+    rows, columns = key_rows[n_old:], days - first_day
+    _, first_rows = np.unique(rows * ranks_by_day.shape[1] + columns, return_index=True)
+    in_matrix = np.zeros(len(rows), dtype=bool)
+    in_matrix[first_rows] = True
+    in_matrix &= ranks_by_day[rows, columns] == 0
+    ranks_by_day[rows[in_matrix], columns[in_matrix]] = ranks[in_matrix]
+
+    # the bump chart averages ranks per (track, artists) pair but counts days per track,
+    # pairs are numbered in code order so mean rank ties break the same way everywhere
+    pairs, row_pair = np.unique(keys[:, 1:], axis=0, return_inverse=True)
+    tracks, pair_track = np.unique(pairs[:, 0], return_inverse=True)
+    return {
+        'keys': keys,
+        'first_day': int(first_day),
+        'dates': (first_day + np.arange(ranks_by_day.shape[1])).astype('datetime64[D]'),
+        'ranks': ranks_by_day,
+        'extra_rows': np.concatenate([key_rows[:n_old][matrix['extra_rows']], rows[~in_matrix]]),
+        'extra_days': np.concatenate([matrix['extra_days'], days[~in_matrix]]).astype(np.int64),
+        'extra_ranks': np.concatenate([matrix['extra_ranks'], ranks[~in_matrix]]).astype(np.int8),
+        'row_pair': row_pair.ravel(),
+        'pair_track': pair_track.ravel(),
+        'tracks': tracks,
+    }
+
+
+def _matrix_rows(state, first, last):
+    chart = load_chart(['spotify_id', 'track_name', 'artists', 'daily_rank'], state)
+    return (chart['spotify_id'].cat.codes.values[first:last],
+            chart['track_name'].cat.codes.values[first:last],
+            chart['artists'].cat.codes.values[first:last],
+            _day_numbers(chart_index(state)['snapshot_date'][first:last]),
+            chart['daily_rank'].values[first:last])
+
+
+def _build_rank_matrix(state, country_code):
+    offsets = chart_index(state)['offsets']
+    return _extend_rank_matrix(None, *_matrix_rows(state, offsets[country_code], offsets[country_code + 1]))
+
+
+def rank_matrix(country_name, state=None):
+    '''
+        daily ranks of a country as an int8 (row, day) matrix, 0 when the row did not chart.
+        Rows are the (song, track, artists) code triples in keys, columns the days in dates;
+        more chart rows of a row on the same day are listed in extra_rows, extra_days and extra_ranks.
+    '''
+    state = state or current_state()
+    countries = chart_index(state)['countries']
+    if country_name not in countries:
+        return None
+    country_code = countries.get_loc(country_name)
+    return _shared(state, ('rank_matrix', country_code), lambda: _build_rank_matrix(state, country_code))
+
+
+def _window_columns(matrix, start_date, end_date):
+    first = max(_day_numbers(np.array([_to_datetime64(start_date)]))[0] - matrix['first_day'], 0)
+    last = _day_numbers(np.array([_to_datetime64(end_date)]))[0] - matrix['first_day'] + 1
+    return first, max(first, last)
+
+
+def rank_window(matrix, start_date, end_date):
+    '''
+        the matrix columns of the days between two dates, both inclusive
+    '''
+    first, last = _window_columns(matrix, start_date, end_date)
+    return matrix['ranks'][:, first:last]
+
+
+def staying_power_summary(start_date, end_date, country_name, staying=STAYING_TRACKS, top=TOP_TRACKS, state=None):
+    '''
+        track codes and mean ranks of the top best ranked pairs among the tracks
+        with the most days in the chart between two dates
+    '''
+    matrix = rank_matrix(country_name, state)
+    window = rank_window(matrix, start_date, end_date)
+    n_pairs = len(matrix['pair_track'])
+    if window.size == 0:
+        return np.array([], dtype=np.int64), np.array([])
+
+    # days in and rank sums of every row, with its extra chart rows, then of every pair and track
+    first, last = _window_columns(matrix, start_date, end_date)
+    extra_columns = matrix['extra_days'] - matrix['first_day']
+    extra = (extra_columns >= first) & (extra_columns < last)
+    n_rows = len(matrix['keys'])
+    row_days = np.count_nonzero(window, axis=1) + np.bincount(matrix['extra_rows'][extra], minlength=n_rows)
+    row_rank_sums = window.sum(axis=1, dtype=np.int64) + np.bincount(matrix['extra_rows'][extra], weights=matrix['extra_ranks'][extra], minlength=n_rows)
+    pair_days = np.bincount(matrix['row_pair'], weights=row_days, minlength=n_pairs)
+    pair_rank_sums = np.bincount(matrix['row_pair'], weights=row_rank_sums, minlength=n_pairs)
+
+    # keep the tracks with at least as many days as the staying-th one
+    track_days = np.bincount(matrix['pair_track'], weights=pair_days, minlength=len(matrix['tracks']))
+    charting_days = track_days[track_days > 0]
+    if len(charting_days) == 0:
+        return np.array([], dtype=np.int64), np.array([])
+    if len(charting_days) > staying - 1:
+        threshold = -np.partition(-charting_days, staying - 1)[staying - 1]
+    else:
+        threshold = charting_days.min()
+    candidates = np.flatnonzero((pair_days > 0) & (track_days[matrix['pair_track']] >= threshold))
+    mean_rank = np.round(pair_rank_sums[candidates] / pair_days[candidates], 2)
+
+    # partial selection of the best mean ranks, ties are kept in (track, artists) order
+    if len(mean_rank) > top:
+        cutoff = np.partition(mean_rank, top - 1)[top - 1]
+        keep = np.flatnonzero(mean_rank <= cutoff)
+        candidates, mean_rank = candidates[keep], mean_rank[keep]
+    best = np.lexsort((candidates, mean_rank))[:top]
+    return matrix['tracks'][matrix['pair_track'][candidates[best]]], mean_rank[best]
+
+
+def top_tracks_by_staying_power(start_date, end_date, country_name, cols=['snapshot_date', 'daily_rank', 'track_name', 'artists'], state=None, backend=None):
+    '''
+        chart rows between two dates of the songs selected by staying_power_summary, sorted by date
+    '''
+    state = state or current_state()
+    if (backend or QUERY_BACKEND) == 'duckdb':
+        return _sql_top_tracks(start_date, end_date, country_name, cols, state)
+    if rank_matrix(country_name, state) is None:
+        return load_chart(cols, state)[cols].iloc[0:0]
+    track_codes, mean_rank = staying_power_summary(start_date, end_date, country_name, state=state)
+    chart = load_chart(cols, state)
+    start, stop = country_date_rows(country_name, start_date, end_date, state)
+    rows = chart.iloc[start:stop]
+    return rows[np.isin(rows['track_name'].cat.codes.values, track_codes)][cols]
+
+
+def _extend_genre_index(index, genres, enao):
+    '''
+        index with the enao rows of more genres strings appended, or a new one when index is None
+    '''
+    enao_rows = {}
+    for row, genre in enumerate(enao['genre']):
+        enao_rows.setdefault(genre, []).append(row)
+
+    # CSR lists of enao rows, one list per distinct genres string of the chart
+    offsets = [0] if index is None else index['offsets'].tolist()
+    rows = [] if index is None else index['enao_rows'].tolist()
+    for track_genres in genres:
+        for genre in track_genres.split(', '):
+            rows.extend(enao_rows.get(genre, ()))
+        offsets.append(len(rows))
+    return {'offsets': np.array(offsets, dtype=np.int64), 'enao_rows': np.array(rows, dtype=np.int64)}
+
+
+def _read_genres_split(state):
+    '''
+        genres strings of the cached table split into genre tokens at build time, if up to date
+    '''
+    try:
+        with np.load(_version_path(state['meta'], 'genres_split.npz')) as split:
+            if str(split['sha256']) != state['meta']['sha256']:
+                return None
+            return {name: split[name] for name in ['offsets', 'token_ids', 'tokens']}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _build_genre_index(state):
+    genres = load_chart(['genres'], state)['genres'].cat.categories
+    enao = load_enao()
+    split = _read_genres_split(state)
+    if split is None:
+        return _extend_genre_index(None, genres, enao)
+
+    # enao rows of every token, gathered into the lists of the genres strings using it
+    token_index = _extend_genre_index(None, split['tokens'], enao)
+    starts = token_index['offsets'][split['token_ids']]
+    lengths = token_index['offsets'][split['token_ids'] + 1] - starts
+    ends = np.cumsum(lengths)
+    positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - ends + lengths, lengths)
+    index = {'offsets': np.concatenate([[0], ends])[split['offsets']], 'enao_rows': token_index['enao_rows'][positions]}
+    # genres strings of ingested segments come after the cached ones
+    return _extend_genre_index(index, genres[len(split['offsets']) - 1:], enao)
+
+
+def genre_index(state=None):
+    '''
+        enao rows of every genres string in the chart table, parsed once
+    '''
+    state = state or current_state()
+    return _shared(state, 'genre_index', lambda: _build_genre_index(state))
+
+
+def genre_song_counts(start_date, end_date, country_name, state=None):
+    '''
+        number of distinct songs of each enao genre in a country's charts between two dates,
+        aligned with the rows of load_enao()
+    '''
+    state = state or current_state()
+    index = genre_index(state)
+    chart = load_chart(['spotify_id', 'genres'], state)
+    start, stop = country_date_rows(country_name, start_date, end_date, state)
+
+    # first row of every distinct song, like drop_duplicates(subset='spotify_id')
+    song_codes = chart['spotify_id'].cat.codes.values[start:stop]
+    first_rows = np.unique(song_codes, return_index=True)[1]
+    genres_codes = chart['genres'].cat.codes.values[start:stop][first_rows]
+    genres_codes, songs = np.unique(genres_codes[genres_codes >= 0], return_counts=True)
+
+    # gather the CSR lists of the selected genres strings and count their enao rows
+    list_starts = index['offsets'][genres_codes]
+    list_lengths = index['offsets'][genres_codes + 1] - list_starts
+    list_shift = np.repeat(list_starts - np.cumsum(list_lengths) + list_lengths, list_lengths)
+    positions = np.arange(list_lengths.sum()) + list_shift
+    n_genres = len(load_enao())
+    return np.bincount(index['enao_rows'][positions], weights=np.repeat(songs, list_lengths), minlength=n_genres).astype(np.int64)
+
+
+def _build_genre_table():
+    enao = load_enao()
+    return {col: enao[col].to_numpy() for col in ['genre', 'left', 'top', 'color']}
+
+
+def genre_table():
+    '''
+        enao genre name, coordinates and color as arrays indexed by enao row
+    '''
+    return _shared(_enao_state(), 'genre_table', _build_genre_table)
+
+
+_genre_executor = None
+_genre_executor_lock = threading.Lock()
+
+
+def _genre_pool():
+    global _genre_executor
+    with _genre_executor_lock:
+        if _genre_executor is None:
+            _genre_executor = ThreadPoolExecutor(max_workers=GENRE_WORKERS, thread_name_prefix='genre-space')
+    return _genre_executor
+
+
+def genre_space(start_date, end_date, country_names, state=None, backend=None):
+    '''
+        one row per (country, charting enao genre) with its coordinates, color and song count
+    '''
+    state = state or current_state()
+    if (backend or QUERY_BACKEND) == 'duckdb':
+        return _sql_genre_space(start_date, end_date, country_names, state)
+    table = genre_table()
+    # the shared indexes are built before fanning out, so the threads only count
+    chart_index(state)
+    genre_index(state)
+    load_chart(['spotify_id', 'genres'], state)
+    if len(country_names) > 1 and GENRE_WORKERS > 1:
+        song_counts = list(_genre_pool().map(lambda country_name: genre_song_counts(start_date, end_date, country_name, state), country_names))
+    else:
+        song_counts = [genre_song_counts(start_date, end_date, country_name, state) for country_name in country_names]
+    genre_rows = [np.flatnonzero(song_count) for song_count in song_counts]
+
+    # fill the multi-country columns in one preallocated pass
+    n_rows = sum(len(rows) for rows in genre_rows)
+    plot_rows = np.empty(n_rows, dtype=np.int64)
+    song_count = np.empty(n_rows, dtype=np.int64)
+    country = np.empty(n_rows, dtype=object)
+    position = 0
+    for country_name, counts, rows in zip(country_names, song_counts, genre_rows):
+        end = position + len(rows)
+        plot_rows[position:end] = rows
+        song_count[position:end] = counts[rows]
+        country[position:end] = country_name
+        position = end
+
+    return _genre_space_frame(table, plot_rows, song_count, country)
+
+
+def _genre_space_frame(table, plot_rows, song_count, country):
+    return pd.DataFrame({
+        'genre': table['genre'][plot_rows],
+        'left': table['left'][plot_rows],
+        'top': table['top'][plot_rows],
+        'color': table['color'][plot_rows],
+        'song_count': song_count,
+        'country': country,
+    })
+
+
+# DuckDB backend: the same queries in SQL over Arrow tables sharing the loaded arrays.
+# Categorical columns are queried by code, so ties break in the same order as above.
+STAYING_POWER_SQL = '''
+    WITH span AS (
+        SELECT row, track, artists, rank FROM chart
+        WHERE country = $country AND snapshot_date BETWEEN $start_date AND $end_date
+    ),
+    track_days AS (
+        SELECT track, count(*) AS days_in FROM span GROUP BY track
+    ),
+    threshold AS (
+        -- days of the staying-th track, or the fewest when fewer tracks charted
+        SELECT min(days_in) AS days_in FROM (SELECT days_in FROM track_days ORDER BY days_in DESC LIMIT $staying)
+    ),
+    summary AS (
+        SELECT track, artists, round_even(sum(rank) / count(*), 2) AS mean_rank
+        FROM span JOIN track_days USING (track)
+        WHERE days_in >= (SELECT days_in FROM threshold)
+        GROUP BY track, artists
+        ORDER BY mean_rank, track, artists
+        LIMIT $top
+    )
+    SELECT row FROM span WHERE track IN (SELECT track FROM summary) ORDER BY row
+'''
+
+GENRE_SPACE_SQL = '''
+    WITH selection AS (
+        SELECT unnest($positions) AS position, unnest($countries) AS country
+    ),
+    songs AS (
+        -- genres of the first row of every distinct song, like drop_duplicates(subset='spotify_id')
+        SELECT selection.position, arg_min(chart.genres, chart.row) AS genres
+        FROM selection JOIN chart ON chart.country = selection.country
+        WHERE chart.snapshot_date BETWEEN $start_date AND $end_date
+        GROUP BY selection.position, chart.song
+    )
+    SELECT songs.position, genre_lists.enao_row, count(*) AS song_count
+    FROM songs JOIN genre_lists ON genre_lists.genres = songs.genres
+    GROUP BY songs.position, genre_lists.enao_row
+    ORDER BY songs.position, genre_lists.enao_row
+'''
+
+
+def _build_sql_chart(state):
+    chart = load_chart(['country_name', 'snapshot_date', 'spotify_id', 'track_name', 'artists', 'daily_rank', 'genres'], state)
+    return pa.table({
+        'row': np.arange(len(chart), dtype=np.int64),
+        'country': chart['country_name'].cat.codes.to_numpy(),
+        'snapshot_date': chart['snapshot_date'].to_numpy(),
+        'song': chart['spotify_id'].cat.codes.to_numpy(),
+        'track': chart['track_name'].cat.codes.to_numpy(),
+        'artists': chart['artists'].cat.codes.to_numpy(),
+        'rank': chart['daily_rank'].to_numpy(),
+        'genres': chart['genres'].cat.codes.to_numpy(),
+    })
+
+
+def _build_sql_genre_lists(state):
+    index = genre_index(state)
+    lengths = np.diff(index['offsets'])
+    return pa.table({'genres': np.repeat(np.arange(len(lengths)), lengths), 'enao_row': index['enao_rows']})
+
+
+def _sql_query(state, tables, query, parameters):
+    '''
+        columns of the query's result as NumPy arrays, run on a cursor of the state's database
+    '''
+    def connect():
+        import duckdb
+        return duckdb.connect()
+
+    # registered tables are private to a cursor, one cursor per query keeps threads apart
+    cursor = _shared(state, 'duckdb', connect).cursor()
+    try:
+        for name, builder in tables.items():
+            cursor.register(name, _shared(state, ('sql', name), lambda: builder(state)))
+        return cursor.execute(query, parameters).fetchnumpy()
+    finally:
+        cursor.close()
+
+
+def _sql_top_tracks(start_date, end_date, country_name, cols, state, staying=STAYING_TRACKS, top=TOP_TRACKS):
+    chart = load_chart(cols, state)
+    countries = chart_index(state)['countries']
+    if country_name not in countries:
+        return chart[cols].iloc[0:0]
+    result = _sql_query(state, {'chart': _build_sql_chart}, STAYING_POWER_SQL, {
+        'country': countries.get_loc(country_name),
+        'start_date': pd.Timestamp(start_date).to_pydatetime(),
+        'end_date': pd.Timestamp(end_date).to_pydatetime(),
+        'staying': staying,
+        'top': top,
+    })
+    return chart.iloc[result['row']][cols]
+
+
+def _sql_genre_space(start_date, end_date, country_names, state):
+    countries = chart_index(state)['countries']
+    positions = [position for position, country_name in enumerate(country_names) if country_name in countries]
+    result = _sql_query(state, {'chart': _build_sql_chart, 'genre_lists': _build_sql_genre_lists}, GENRE_SPACE_SQL, {
+        'positions': positions,
+        'countries': [countries.get_loc(country_names[position]) for position in positions],
+        'start_date': pd.Timestamp(start_date).to_pydatetime(),
+        'end_date': pd.Timestamp(end_date).to_pydatetime(),
+    })
+    country = np.array(country_names, dtype=object)[result['position']] if len(result['position']) else np.empty(0, dtype=object)
+    return _genre_space_frame(genre_table(), result['enao_row'], result['song_count'], country)
+
+
+# Columns of the ranking page table
+TABLE_COLUMNS = ['track_name', 'artists', 'album_release_date', 'daily_rank', 'daily_movement']
+
+# DataTable filter_query operators, longest spellings first
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith ']]
+COMPARISONS = {'ge': operator.ge, 'le': operator.le, 'lt': operator.lt, 'gt': operator.gt, 'ne': operator.ne, 'eq': operator.eq}
+
+
+def split_filter_part(filter_part):
+    '''
+        column, operator and value of one "&&"-separated part of a DataTable filter_query
+    '''
+    for operator_type in FILTER_OPERATORS:
+        for operator_name in operator_type:
+            if operator_name in filter_part:
+                name_part, value_part = filter_part.split(operator_name, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value_part = value_part.strip()
+                quote = value_part[:1]
+                if quote and quote == value_part[-1] and quote in ('"', "'", '`'):
+                    value = value_part[1:-1].replace('\\' + quote, quote)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+def _category_ranks(state, col):
+    '''
+        position of every category of a column in sorted order, computed once per column
+    '''
+    def build():
+        categories = load_chart([col], state)[col].cat.categories
+        ranks = np.empty(len(categories), dtype=np.int64)
+        ranks[np.argsort(categories.to_numpy(dtype=str), kind='stable')] = np.arange(len(categories))
+        return ranks
+    return _shared(state, ('category_ranks', col), build)
+
+
+def _filter_mask(chart, rows, col, operator_name, value):
+    column = chart[col]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # evaluate the condition once per category, then look it up by code
+        categories = column.cat.categories.astype(str)
+        text = str(int(value)) if isinstance(value, float) and value.is_integer() else str(value)
+        if operator_name == 'contains':
+            matches = categories.str.contains(text, regex=False)
+        elif operator_name == 'datestartswith':
+            matches = categories.str.startswith(text)
+        else:
+            matches = COMPARISONS[operator_name](categories, text)
+        codes = column.cat.codes.to_numpy()[rows]
+        return np.append(np.asarray(matches, dtype=bool), False)[codes]
+
+    values = column.to_numpy()[rows]
+    if not isinstance(value, float):
+        return np.zeros(len(rows), dtype=bool)
+    if operator_name in ('contains', 'datestartswith'):
+        return values == value
+    return COMPARISONS[operator_name](values, value)
+
+
+def _sort_keys(state, chart, rows, col, descending):
+    '''
+        np.lexsort keys of a column, the values, negated when descending, then whether they are
+        missing, so missing values sort last in both directions like pandas
+    '''
+    column = chart[col]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = column.cat.codes.to_numpy()[rows]
+        missing = codes < 0
+        values = _category_ranks(state, col)[codes].astype(np.int64)
+    else:
+        values = column.to_numpy()[rows]
+        missing = pd.isna(values)
+        # small ints are widened so -(-128) does not wrap, floats stay floats
+        values = values.astype(np.float64 if values.dtype.kind == 'f' else np.int64)
+    values = np.where(missing, 0, values)
+    return [-values if descending else values, missing]
+
+
+def _snapshot_blocks(positions, songs, days):
+    '''
+        the first of the positions of every (day, song), like drop_duplicates(subset='spotify_id')
+        on each day, as one block per day
+    '''
+    if len(days) == 0:
+        return {}
+    day_songs = (days - days.min()) * (songs.max() + 2) + songs + 1
+    first_rows = np.sort(np.unique(day_songs, return_index=True)[1])
+    snapshot_days, day_starts = np.unique(days[first_rows], return_index=True)
+    blocks = np.split(positions[first_rows].astype(np.int32), day_starts[1:])
+    return dict(zip(snapshot_days.tolist(), blocks))
+
+
+def _build_snapshots(state, country_code):
+    index = chart_index(state)
+    first, last = index['offsets'][country_code], index['offsets'][country_code + 1]
+    songs = load_chart(['spotify_id'], state)['spotify_id'].cat.codes.to_numpy()[first:last].astype(np.int64)
+    # positions are relative to the country's first row, so rows appended to other countries do not move them
+    return _snapshot_blocks(np.arange(last - first), songs, _day_numbers(index['snapshot_date'][first:last]))
+
+
+def snapshot_rows(country_name, date, state=None):
+    '''
+        rows of a country's chart on a date, one per song, from the per-country snapshot dictionary
+    '''
+    state = state or current_state()
+    index = chart_index(state)
+    if country_name not in index['countries']:
+        return np.array([], dtype=np.int32)
+    country_code = index['countries'].get_loc(country_name)
+    snapshots = _shared(state, ('snapshots', country_code), lambda: _build_snapshots(state, country_code))
+    day = _day_numbers(np.array([_to_datetime64(date)]))[0]
+    block = snapshots.get(int(day))
+    if block is None:
+        return np.array([], dtype=np.int32)
+    return block + index['offsets'][country_code]
+
+
+def table_page(date, country_name, page_current=0, page_size=10, sort_by=None, filter_query='', state=None):
+    '''
+        records of one page of a country's chart on a date, after filtering and sorting,
+        and the number of pages
+    '''
+    state = state or current_state()
+    chart = load_chart(TABLE_COLUMNS, state)
+    rows = snapshot_rows(country_name, date, state)
+
+    for filter_part in (filter_query or '').split(' && '):
+        col, operator_name, value = split_filter_part(filter_part)
+        if col in TABLE_COLUMNS:
+            rows = rows[_filter_mask(chart, rows, col, operator_name, value)]
+
+    if sort_by:
+        # np.lexsort takes the primary key last
+        keys = []
+        for sort in reversed(sort_by):
+            keys += _sort_keys(state, chart, rows, sort['column_id'], sort['direction'] == 'desc')
+        rows = rows[np.lexsort(keys)]
+
+    # only the visible page is turned into records
+    page_rows = rows[page_current * page_size:(page_current + 1) * page_size]
+    columns = {}
+    for col in TABLE_COLUMNS:
+        column = chart[col]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            codes = column.cat.codes.to_numpy()[page_rows]
+            values = column.cat.categories.to_numpy()[codes]
+            columns[col] = [value if code >= 0 else None for value, code in zip(values.tolist(), codes)]
+        else:
+            columns[col] = column.to_numpy()[page_rows].tolist()
+    records = [dict(zip(TABLE_COLUMNS, values)) for values in zip(*columns.values())]
+    return records, max(math.ceil(len(rows) / page_size), 1)
+
+
+def filter_by_country_and_date(start_date, end_date, country_name, drop_duplicates=False, drop_subset=None, cols=[], state=None):
+
+    needed = ['snapshot_date', 'country_name'] + list(cols or CHART_COLUMNS)
+    if drop_duplicates and drop_subset:
+        needed += [drop_subset] if isinstance(drop_subset, str) else list(drop_subset)
+    state = state or current_state()
+    chart = load_chart(needed, state)
+
+    start, stop = country_date_rows(country_name, start_date, end_date, state)
+    date_country_filtered = chart.iloc[start:stop]
+
+    if drop_duplicates:
+        date_country_filtered = date_country_filtered.drop_duplicates(subset=drop_subset, keep='first')
+
+    if cols:
+        date_country_filtered = date_country_filtered[cols]
+
+    return date_country_filtered
+
+
+# Incremental ingestion
+
+def _last_dates(state):
+    '''
+        last loaded snapshot date of every country
+    '''
+    index = chart_index(state)
+    offsets = index['offsets']
+    has_rows = offsets[1:] > offsets[:-1]
+    return dict(zip(index['countries'][has_rows], index['snapshot_date'][offsets[1:][has_rows] - 1]))
+
+
+def append_segment(chart):
+    '''
+        store chart rows of days after the loaded ones as a new segment, in a new data version
+        of the cache, running workers load it in refresh()
+    '''
+    with cache_lock():
+        return _append_segment(chart)
+
+
+def _append_segment(chart):
+    meta = ensure_chart_cache()
+    if set(chart.columns) != set(meta['columns']):
+        raise ValueError(f'expected the columns {meta["columns"]}, got {list(chart.columns)}')
+    chart = normalize_chart(chart[meta['columns']])
+    if chart.empty:
+        raise ValueError('no rows to append')
+
+    # segments only add later days, so every country's rows stay sorted by date
+    last_dates = _last_dates(_new_state(meta))
+    first_dates = chart.groupby('country_name', observed=True)['snapshot_date'].min()
+    stale = [country for country, date in first_dates.items() if country in last_dates and date <= last_dates[country]]
+    if stale:
+        raise ValueError(f'{", ".join(stale)} already have days on or after the appended ones, rebuild the cache instead')
+
+    version = meta['data_version'] + 1
+    segment = {
+        'path': f'{version:06d}.feather',
+        'first_date': chart['snapshot_date'].min().strftime('%Y-%m-%d'),
+        'last_date': chart['snapshot_date'].max().strftime('%Y-%m-%d'),
+        'rows': len(chart),
+    }
+    # the rows are merged into new column files, states may still be reading the current ones
+    source = _version_path(meta)
+    build_dir = tempfile.mkdtemp(prefix='tmp.', dir=VERSIONS_DIR)
+    try:
+        rows = _merge_segments(meta, source, build_dir, [chart])
+        _link_tree(os.path.join(source, 'segments'), os.path.join(build_dir, 'segments'))
+        os.makedirs(os.path.join(build_dir, 'segments'), exist_ok=True)
+        chart.to_feather(os.path.join(build_dir, 'segments', segment['path']), compression='uncompressed')
+        if os.path.exists(os.path.join(source, 'genres_split.npz')):
+            _link(os.path.join(source, 'genres_split.npz'), os.path.join(build_dir, 'genres_split.npz'))
+        _publish(build_dir, {**meta, 'rows': rows, 'data_version': version, 'segments': meta['segments'] + [segment]})
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return segment
+
+
+def _apply_segments(state, new_state):
+    '''
+        new_state, a later data version of the same build, with the loaded columns, indexes
+        and rollups of state extended by the segments after the state's ones
+    '''
+    old_chart = state.get('chart')
+    if old_chart is None or 'snapshot_date' not in old_chart.columns:
+        return new_state
+
+    # a country's existing rows keep their relative positions, its appended rows follow them
+    old_index = chart_index(state)
+    chart = read_chart(list(old_chart.columns), new_state['meta'])
+    countries = chart['country_name'].cat.categories
+    offsets = np.searchsorted(chart['country_name'].cat.codes.to_numpy(), np.arange(len(countries) + 1))
+    old_counts = np.zeros(len(countries), dtype=np.int64)
+    old_counts[:len(old_index['countries'])] = np.diff(old_index['offsets'])
+    new_state['chart'] = chart
+    new_state['chart_index'] = {'countries': countries, 'offsets': offsets, 'snapshot_date': chart['snapshot_date'].values}
+
+    for key, value in list(state.items()):
+        if not isinstance(key, tuple) or key[0] not in ('rank_matrix', 'snapshots'):
+            continue
+        country_code = key[1]
+        first, last = offsets[country_code] + old_counts[country_code], offsets[country_code + 1]
+        if key[0] == 'rank_matrix':
+            new_state[key] = _extend_rank_matrix(value, *_matrix_rows(new_state, first, last))
+        else:
+            songs = chart['spotify_id'].cat.codes.to_numpy()[first:last].astype(np.int64)
+            days = _day_numbers(chart['snapshot_date'].values[first:last])
+            positions = np.arange(old_counts[country_code], last - offsets[country_code])
+            new_state[key] = {**value, **_snapshot_blocks(positions, songs, days)}
+
+    if 'genre_index' in state:
+        parsed = len(state['genre_index']['offsets']) - 1
+        new_state['genre_index'] = _extend_genre_index(state['genre_index'], chart['genres'].cat.categories[parsed:], load_enao())
+    return new_state
+
+
+# listener(first_date, last_date) calls after a refresh, with None twice when the whole cache changed
+_refresh_listeners = []
+_refresh_lock = threading.Lock()
+_refresh = {'checked': time.monotonic()}
+
+
+def on_refresh(listener):
+    '''
+        run listener(first_date, last_date) with the ingested dates whenever refresh() loads new data
+    '''
+    _refresh_listeners.append(listener)
+    return listener
+
+
+def refresh():
+    '''
+        load the segments ingested since the worker's data version and swap the new state in,
+        returns whether the data changed
+    '''
+    global _state
+    with _refresh_lock:
+        state = current_state()
+        new_state = _new_state()
+        applied = len(state['segments'])
+        if new_state['meta']['build'] == state['meta']['build'] and new_state['segments'][:applied] == state['segments']:
+            if len(new_state['segments']) == applied:
+                return False
+            segments = new_state['segments'][applied:]
+            new_state = _apply_segments(state, new_state)
+            first_date = min(segment['first_date'] for segment in segments)
+            last_date = max(segment['last_date'] for segment in segments)
+        else:
+            # the cache was rebuilt, everything is loaded again on demand
+            first_date = last_date = None
+        with _state_lock:
+            _state = new_state
+
+    for listener in _refresh_listeners:
+        listener(first_date, last_date)
+    return True
+
+
+def _refresh_in_background():
+    try:
+        refresh()
+    except Exception:
+        logger.exception('could not load the ingested chart data')
+
+
+def maybe_refresh():
+    '''
+        start refresh() on a background thread once every DATA_REFRESH_SECONDS
+    '''
+    if DATA_REFRESH_SECONDS <= 0 or time.monotonic() - _refresh['checked'] < DATA_REFRESH_SECONDS:
+        return
+    _refresh['checked'] = time.monotonic()
+    if not _refresh_lock.locked():
+        threading.Thread(target=_refresh_in_background, name='data-refresh', daemon=True).start()
+
+
+if __name__ == '__main__':
+    meta = build_chart_cache()
+    print(f"Cached {len(meta['columns'])} columns of {CHART_PATH} in {_version_path(meta)}")
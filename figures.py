@@ -0,0 +1,272 @@
+import base64
+import json
+import math
+import threading
+import numpy as np
+import plotly.colors
+import plotly.io as pio
+from data_store import STAYING_TRACKS, TOP_TRACKS, genre_table, load_chart, rank_matrix
+
+# Genre-space outline written by build_hull.py
+HULL_PATH = './data/enao_hull.json'
+
+# Axis labels and ranges of the Every Noise at Once genre-space
+ENAO_X_LABEL = '← denser and atmospheric | spikier and bouncier →'
+ENAO_Y_LABEL = '← organic | mechanical and electric →'
+ENAO_X_RANGE = [-100, 1550]
+ENAO_Y_RANGE = [-1000, 23500]
+
+# Facet grid of the per-country genre-space, same spacing as plotly express
+FACET_COL_WRAP = 3
+FACET_COL_SPACING = 0.02
+FACET_ROW_SPACING = 0.07
+MARKER_SIZE_MAX = 20
+
+# Line colors of the bump chart, in plotly express order
+BUMP_COLORS = plotly.colors.qualitative.Plotly
+
+_figures = {}
+_figures_lock = threading.RLock()
+
+
+def _compact(values):
+    '''
+        plain list of the values, as integers when they have no fractional part
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    if np.all(values == np.round(values)):
+        return values.astype(np.int64).tolist()
+    return np.round(values, 2).tolist()
+
+
+def _load_hull():
+    with open(HULL_PATH) as file:
+        rings = json.load(file)['rings']
+    # the rings of a concave outline are drawn as one line, split by gaps
+    alpha_x, alpha_y = [], []
+    for ring in rings:
+        if alpha_x:
+            alpha_x.append(None)
+            alpha_y.append(None)
+        alpha_x += ring['x']
+        alpha_y += ring['y']
+    return alpha_x, alpha_y
+
+
+def load_hull():
+    '''
+        x and y coordinates of the genre-space outline
+    '''
+    return _cached('hull', _load_hull)
+
+
+def _build_genre_space_figure():
+    table = genre_table()
+    alpha_x, alpha_y = load_hull()
+    figure = {
+        'data': [
+            # every genre in a single WebGL trace, colored per point
+            {
+                'type': 'scattergl',
+                'mode': 'markers',
+                'x': _compact(table['left']),
+                'y': _compact(table['top']),
+                'hovertext': table['genre'].tolist(),
+                'hovertemplate': f'<b>%{{hovertext}}</b><br><br>{ENAO_X_LABEL}=%{{x}}<br>{ENAO_Y_LABEL}=%{{y}}<extra></extra>',
+                'marker': {'color': table['color'].tolist(), 'symbol': 'circle'},
+                'showlegend': False,
+            },
+            {
+                'type': 'scatter',
+                'mode': 'lines',
+                'x': alpha_x,
+                'y': alpha_y,
+                'line': {'color': 'black', 'width': 0.5},
+                'showlegend': False,
+            },
+        ],
+        'layout': {
+            'template': pio.templates['plotly'],
+            'title': {'text': 'Every Noise at Once Genre-Space'},
+            'height': 400,
+            'width': 400,
+            'xaxis': {'range': ENAO_X_RANGE, 'title': {'text': ENAO_X_LABEL}},
+            'yaxis': {'range': ENAO_Y_RANGE, 'title': {'text': ENAO_Y_LABEL}},
+        },
+    }
+    return figure
+
+
+def _cached(name, builder):
+    value = _figures.get(name)
+    if value is None:
+        with _figures_lock:
+            value = _figures.get(name)
+            if value is None:
+                value = builder()
+                _figures[name] = value
+    return value
+
+
+def genre_space_figure():
+    '''
+        the home page genre-space figure, as a plain dict ready for dcc.Graph, built on first use
+    '''
+    return _cached('genre_space', _build_genre_space_figure)
+
+
+def _axis_suffix(number):
+    return '' if number == 1 else str(number)
+
+
+def genre_facet_figure(genre_space, title):
+    '''
+        facet grid of the genre_space() rows, one WebGL trace per country colored per point
+    '''
+    countries = list(dict.fromkeys(genre_space['country']))
+    n_cols = max(min(len(countries), FACET_COL_WRAP), 1)
+    n_rows = max(math.ceil(len(countries) / n_cols), 1)
+    width = (1 - FACET_COL_SPACING * (n_cols - 1)) / n_cols
+    height = (1 - FACET_ROW_SPACING * (n_rows - 1)) / n_rows
+    alpha_x, alpha_y = load_hull()
+
+    song_count = genre_space['song_count'].to_numpy()
+    size_ref = max(song_count.max(initial=1), 1) / MARKER_SIZE_MAX ** 2
+    facet = genre_space['country'].to_numpy()
+
+    data, annotations = [], []
+    layout = {
+        'template': pio.templates['plotly'],
+        'title': {'text': title},
+        'showlegend': False,
+    }
+    for position, country in enumerate(countries):
+        # facets fill rows from the top, axes are numbered from the bottom row like plotly express
+        row, col = divmod(position, n_cols)
+        number = (n_rows - 1 - row) * n_cols + col + 1
+        xaxis, yaxis = 'x' + _axis_suffix(number), 'y' + _axis_suffix(number)
+        x_domain = [col * (width + FACET_COL_SPACING), col * (width + FACET_COL_SPACING) + width]
+        y_bottom = (n_rows - 1 - row) * (height + FACET_ROW_SPACING)
+        y_domain = [y_bottom, y_bottom + height]
+
+        rows = facet == country
+        data.append({
+            'type': 'scattergl',
+            'mode': 'markers',
+            'x': _compact(genre_space['left'].to_numpy()[rows]),
+            'y': _compact(genre_space['top'].to_numpy()[rows]),
+            'hovertext': genre_space['genre'].to_numpy()[rows].tolist(),
+            'hovertemplate': f'<b>%{{hovertext}}</b><br><br>country={country}<br>{ENAO_X_LABEL}=%{{x}}<br>{ENAO_Y_LABEL}=%{{y}}<br>song_count=%{{marker.size}}<extra></extra>',
+            'marker': {
+                'color': genre_space['color'].to_numpy()[rows].tolist(),
+                'size': song_count[rows].tolist(),
+                'sizemode': 'area',
+                'sizeref': size_ref,
+                'opacity': 0.8,
+            },
+            'xaxis': xaxis,
+            'yaxis': yaxis,
+        })
+        data.append({
+            'type': 'scatter',
+            'mode': 'lines',
+            'x': alpha_x,
+            'y': alpha_y,
+            'line': {'color': 'black', 'width': 0.5},
+            'hoverinfo': 'skip',
+            'xaxis': xaxis,
+            'yaxis': yaxis,
+        })
+
+        layout['xaxis' + _axis_suffix(number)] = {
+            'anchor': yaxis, 'domain': x_domain, 'range': ENAO_X_RANGE, 'title': {'text': ''},
+            'showticklabels': row == n_rows - 1,
+            **({} if number == 1 else {'matches': 'x'}),
+        }
+        layout['yaxis' + _axis_suffix(number)] = {
+            'anchor': xaxis, 'domain': y_domain, 'range': ENAO_Y_RANGE, 'title': {'text': ''},
+            'showticklabels': col == 0,
+            **({} if number == 1 else {'matches': 'y'}),
+        }
+        annotations.append({
+            'text': country, 'showarrow': False,
+            'xref': 'paper', 'x': sum(x_domain) / 2, 'xanchor': 'center',
+            'yref': 'paper', 'y': y_domain[1], 'yanchor': 'bottom',
+        })
+
+    # shared axis labels
+    annotations.append({'text': ENAO_X_LABEL, 'showarrow': False, 'xref': 'paper', 'x': 0.5, 'xanchor': 'center', 'yref': 'paper', 'y': -0.1})
+    annotations.append({'text': ENAO_Y_LABEL, 'showarrow': False, 'xref': 'paper', 'x': -0.08, 'xanchor': 'center',
+                        'yref': 'paper', 'y': 0.5, 'yanchor': 'middle', 'textangle': 270})
+    layout['annotations'] = annotations
+    return {'data': data, 'layout': layout}
+
+
+def bump_chart_figure(rank_rows, title):
+    '''
+        one WebGL line per track of the (snapshot_date, daily_rank, track_name) rows, sorted by date
+    '''
+    track_codes = rank_rows['track_name'].cat.codes.to_numpy()
+    track_names = rank_rows['track_name'].cat.categories
+    dates = np.datetime_as_string(rank_rows['snapshot_date'].to_numpy(), unit='D')
+    ranks = rank_rows['daily_rank'].to_numpy()
+
+    # tracks in order of first appearance, like plotly express
+    codes, first_rows = np.unique(track_codes, return_index=True)
+    data = []
+    for number, code in enumerate(codes[np.argsort(first_rows)]):
+        rows = track_codes == code
+        name = track_names[code]
+        data.append({
+            'type': 'scattergl',
+            'mode': 'lines',
+            'x': dates[rows].tolist(),
+            'y': ranks[rows].tolist(),
+            'name': name,
+            'legendgroup': name,
+            'line': {'color': BUMP_COLORS[number % len(BUMP_COLORS)]},
+            'hovertemplate': f'track_name={name}<br>Date=%{{x}}<br>Daily Rank=%{{y}}<extra></extra>',
+        })
+
+    return {'data': data, 'layout': bump_chart_layout(title)}
+
+
+def bump_chart_layout(title):
+    return {
+        'template': pio.templates['plotly'],
+        'title': {'text': title},
+        'xaxis': {'title': {'text': 'Date'}, 'type': 'date'},
+        'yaxis': {'title': {'text': 'Daily Rank'}, 'range': [50, 1]},
+        'legend': {'title': {'text': 'track_name'}, 'orientation': 'h', 'yanchor': 'bottom', 'y': -0.50, 'xanchor': 'right', 'x': 1},
+    }
+
+
+def bump_chart_store(country_name, title):
+    '''
+        a country's rank matrix and the bump chart layout, for assets/bump_chart.js
+        to draw the chart of any date range in the browser
+    '''
+    matrix = rank_matrix(country_name)
+    if matrix is None:
+        matrix = {'first_day': 0, 'ranks': np.zeros((0, 0), dtype=np.int8), 'row_pair': np.array([], dtype=np.int64),
+                  'pair_track': np.array([], dtype=np.int64), 'tracks': np.array([], dtype=np.int64),
+                  'extra_rows': np.array([], dtype=np.int64), 'extra_days': np.array([], dtype=np.int64), 'extra_ranks': np.array([], dtype=np.int8)}
+    track_names = load_chart(['track_name'])['track_name'].cat.categories
+    return {
+        'first_day': matrix['first_day'],
+        'days': matrix['ranks'].shape[1],
+        # row-major (row, day) int8 ranks, 0 when the row's song did not chart that day
+        'ranks': base64.b64encode(np.ascontiguousarray(matrix['ranks']).tobytes()).decode(),
+        # more chart rows of a row on the same day, as (row, day, rank) lists
+        'extra_rows': matrix['extra_rows'].tolist(),
+        'extra_days': (matrix['extra_days'] - matrix['first_day']).tolist(),
+        'extra_ranks': matrix['extra_ranks'].tolist(),
+        # pairs are numbered in (track, artists) code order, which breaks mean rank ties like the server
+        'row_pair': matrix['row_pair'].tolist(),
+        'row_track': matrix['pair_track'][matrix['row_pair']].tolist(),
+        'tracks': [track_names[code] if code >= 0 else None for code in matrix['tracks']],
+        'staying': STAYING_TRACKS,
+        'top': TOP_TRACKS,
+        'colors': BUMP_COLORS,
+        'layout': bump_chart_layout(title),
+    }
@@ -0,0 +1,47 @@
+import argparse
+import pandas as pd
+from callback_cache import invalidate_dates
+from data_store import CHART_PATH, append_segment, build_chart_cache, read_chart_csv
+
+# Ingestion of Top 50 snapshots into the columnar cache, e.g.
+#   python ingest.py build                                  (whole history, streamed in chunks)
+#   python ingest.py append data/daily/2024-06-12.csv       (days after the cached ones)
+# running workers load the new data within DATA_REFRESH_SECONDS
+
+
+def build(source=CHART_PATH):
+    '''
+        rebuild the cache, its partitions and dictionaries from the chart CSV
+    '''
+    meta = build_chart_cache(source)
+    # every cached output may have changed
+    invalidate_dates()
+    return meta
+
+
+def append(paths):
+    '''
+        append the chart rows of one or more daily CSV files as a new cache segment
+    '''
+    chart = pd.concat([read_chart_csv(path) for path in paths], ignore_index=True)
+    segment = append_segment(chart)
+    # the disk cache outlives the workers, drop its entries of the new days here too
+    invalidate_dates(segment['first_date'], segment['last_date'])
+    return segment
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add Top 50 snapshots to the chart cache')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='rebuild the cache from the chart CSV, streamed in CHART_CHUNK_ROWS chunks')
+    build_parser.add_argument('source', nargs='?', default=CHART_PATH, help='chart CSV file')
+    append_parser = commands.add_parser('append', help='append days newer than the cached ones')
+    append_parser.add_argument('paths', nargs='+', help='CSV files with the columns of the chart CSV')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        meta = build(args.source)
+        print(f"Cached {len(meta['columns'])} columns of {args.source}")
+    elif args.command == 'append':
+        segment = append(args.paths)
+        print(f"Appended {segment['rows']} rows from {segment['first_date']} to {segment['last_date']} as {segment['path']}")
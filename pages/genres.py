@@ -1,28 +1,10 @@
-import pandas as pd
-import numpy as np
 import dash
-import pickle
-from scipy.spatial import Delaunay
-from shapely.geometry import MultiPoint
-from dash import dcc, html, dash_table, callback, Input, Output
+from dash import dcc, html, clientside_callback, ClientsideFunction, Input, Output
 # from dash.dependencies import 
-import plotly.express as px
-import plotly.graph_objects as go
-
-# Load Data
-
-spotify_top50_daily_wGenres = pd.read_csv('./data/universal_top_songs_final.csv',usecols=['spotify_id', 'track_name', 'artists', 'snapshot_date', 'genres', 'country_name', 'country'])
-enao = pd.read_csv('./data/enao.csv')
-
-unique_countries = list(zip(spotify_top50_daily_wGenres['country'].unique(),spotify_top50_daily_wGenres['country_name'].unique()))
-dropdown_options = [{'label': country_name, 'value': country_name} for country_code, country_name in unique_countries]
-
-# Enao Alpha Shape
-
-# Load x and y coordinates from the alpha shape polygon
-with open('./data/convex_hull_enao', 'rb') as file:
-  alpha_x, alpha_y = pickle.load(file)
+from callback_cache import is_date, memoize
+from callback_metrics import record_rows, stage
 
+# the data layer is imported on first use, see app.py
 
 
 # Initialize Dash page
@@ -30,142 +12,104 @@ dash.register_page(__name__)
 
 
 # App layout
-layout = html.Div([
+# read on every visit, see data_store.country_options
+def layout():
+    from data_store import country_options, date_span
+    dropdown_options = country_options()
+    first_date, last_date = date_span()
+    return html.Div([
    
     
     
     
     
-    # Begining of first visualization section
+        # Begining of first visualization section
     
-    dcc.Markdown('''### Per Country Genre-space'''),
-    html.Div([
-        # Options row
-        html.Div([
-            html.Label(children=html.B('Choose a time span:'), style={'display': 'block'}),
-            dcc.DatePickerRange(
-                id='date-range-picker',
-                start_date=spotify_top50_daily_wGenres['snapshot_date'].min(),
-                end_date=spotify_top50_daily_wGenres['snapshot_date'].max(),
-                display_format='YYYY-MM-DD'
-            )
-        ], style={'width': '49%', 'display': 'inline-block'}),
-
+        dcc.Markdown('''### Per Country Genre-space'''),
         html.Div([
-            html.Label(children=html.B('Choose a country:'), style={'display': 'block'}),
-            dcc.Dropdown(
-                id='country-dropdown',
-                options=dropdown_options,
-                value=['Global'],
-                multi=True
-                # placeholder='Select a country'
-            )
-        ], style={'width': '49%', 'float': 'right', 'display': 'inline-block'}),
-    ], style={'display': 'flex', 'justify-content': 'space-between'}),
-
-    # Interactive visualizations from the first section
-    html.Div([
+            # Options row
+            html.Div([
+                html.Label(children=html.B('Choose a time span:'), style={'display': 'block'}),
+                dcc.DatePickerRange(
+                    id='date-range-picker',
+                    start_date=first_date,
+                    end_date=last_date,
+                    display_format='YYYY-MM-DD'
+                )
+            ], style={'width': '49%', 'display': 'inline-block'}),
+
+            html.Div([
+                html.Label(children=html.B('Choose a country:'), style={'display': 'block'}),
+                dcc.Dropdown(
+                    id='country-dropdown',
+                    options=dropdown_options,
+                    value=['Global'],
+                    multi=True
+                    # placeholder='Select a country'
+                )
+            ], style={'width': '49%', 'float': 'right', 'display': 'inline-block'}),
+        ], style={'display': 'flex', 'justify-content': 'space-between'}),
+
+        # Interactive visualizations from the first section
         html.Div([
-            dcc.Graph(id='enao-graph', style={'width': '100%', 'height': '100%'})
-        ]),#, style={'width': '59%', 'display': 'inline-block', 'padding': '0 20'}),
-
-        # html.Div([
-        #     html.H2(id='table-title'),
-        #     dash_table.DataTable(
-        #         style_data={
-        #             'whiteSpace': 'normal',
-        #             'height': 'auto',
-        #         },
-        #         style_cell={
-        #             'overflow': 'hidden',
-        #             'textOverflow': 'ellipsis',
-        #             'maxWidth': '10px',
-        #         },
-        #         id='music-table',
-        #         columns=[{'name': 'Music', 'id': 'track_name'}, {'name': 'Artists', 'id': 'artists'}],
-        #         data=[],
-        #         page_size=20
-        #     )
-        # ], style={'width': '39%', 'display': 'inline-block', 'height': '800px'}),
-    ]),#, style={'display': 'flex', 'flexDirection': 'row'}),
+            html.Div([
+                dcc.Graph(id='enao-graph', style={'width': '100%', 'height': '100%'})
+            ]),#, style={'width': '59%', 'display': 'inline-block', 'padding': '0 20'}),
+
+            # html.Div([
+            #     html.H2(id='table-title'),
+            #     dash_table.DataTable(
+            #         style_data={
+            #             'whiteSpace': 'normal',
+            #             'height': 'auto',
+            #         },
+            #         style_cell={
+            #             'overflow': 'hidden',
+            #             'textOverflow': 'ellipsis',
+            #             'maxWidth': '10px',
+            #         },
+            #         id='music-table',
+            #         columns=[{'name': 'Music', 'id': 'track_name'}, {'name': 'Artists', 'id': 'artists'}],
+            #         data=[],
+            #         page_size=20
+            #     )
+            # ], style={'width': '39%', 'display': 'inline-block', 'height': '800px'}),
+        ]),#, style={'display': 'flex', 'flexDirection': 'row'}),
 
     
-])
+    ])
 
-# Callback to update graph based on date range selection
-@callback(
+# Callback to update graph based on date range selection, fetched from /figures as cached JSON,
+# see assets/figures.js
+clientside_callback(
+    ClientsideFunction(namespace='figures', function_name='genreGraph'),
     Output('enao-graph', 'figure'),
     [Input('date-range-picker', 'start_date'),
      Input('date-range-picker', 'end_date'),
      Input('country-dropdown', 'value')]
 )
+
+
+def check_graph_inputs(start_date, end_date, country_names):
+    if not (is_date(start_date) and is_date(end_date) and isinstance(country_names, list) and country_names
+            and all(isinstance(country_name, str) for country_name in country_names)):
+        raise ValueError('expected a start date, an end date and a list of country names')
+
+
+@memoize('update_graph', serve_json=True, check_inputs=check_graph_inputs)
 def update_graph(start_date, end_date, country_names):
+    from data_store import genre_space
+    from figures import genre_facet_figure
     
-    all_plots = []
-    for country_name in country_names:
-
-        filtered_df = filter_by_country_and_date(start_date, 
-                                                end_date, 
-                                                country_name, 
-                                                drop_duplicates=True, 
-                                                drop_subset='spotify_id', 
-                                                cols=['spotify_id', 'track_name', 'artists', 'genres'])
-        
-        # Split genres in df_songs into individual rows
-        filtered_data_gere_exp = filtered_df.assign(genres=filtered_df['genres'].str.split(', ')).explode('genres')
-        genre_counts = filtered_data_gere_exp['genres'].value_counts().reset_index()
-        genre_counts.columns = ['genre', 'song_count']
-
-        plot_data_enao = pd.merge(enao, genre_counts, on='genre', how='inner')
-        
-        plot_data_enao['country'] = country_name
-                
-        all_plots.append(plot_data_enao)
-
-
-    final_df = pd.concat(all_plots, ignore_index=True)
-
-    # print(final_df.head())
-    # Create the scatter plot with alpha shape line
-    fig = px.scatter(final_df, x='left', y='top',#height=800,
-                    size='song_count',
-                    facet_col='country',
-                    facet_col_wrap=3,
-                    color='color', color_discrete_map="identity", hover_name='genre',
-                    labels={
-                        "top": "← organic | mechanical and electric →",
-                        "left": "← denser and atmospheric | spikier and bouncier →"
-                    },
-                    title=f'Genres in {country_name}')
-    fig.update_traces(marker=dict(opacity=0.8))
-    fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
-    fig.add_scatter(x=alpha_x, y=alpha_y, mode='lines', line=dict(color='black', width=0.5), showlegend=False, row="all", col="all")
-    fig.update_layout(xaxis=dict(range=[-100, 1550]), yaxis=dict(range=[-1000, 23500]))
-    # turn off axis titels of all axes
-    fig.for_each_xaxis(lambda x: x.update({'title': ''}))
-    fig.for_each_yaxis(lambda y: y.update({'title': ''}))
-
-    # add annotations
-    fig.add_annotation(
-        showarrow=False,
-        xanchor='center',
-        xref='paper', 
-        x=0.5, 
-        yref='paper',
-        y=-0.1,
-        text='← denser and atmospheric | spikier and bouncier →'
-    )
-    fig.add_annotation(
-        showarrow=False,
-        xanchor='center',
-        xref='paper', 
-        x=-0.08, 
-        yanchor='middle',
-        yref='paper',
-        y=0.5,
-        textangle=270,
-        text='← organic | mechanical and electric →'
-    )
+    # genre coordinates and song counts of every selected country
+    with stage('aggregate'):
+        final_df = genre_space(start_date, end_date, country_names)
+    record_rows(len(final_df))
+    country_name = country_names[-1]
+
+    # one WebGL trace per country facet
+    with stage('figure'):
+        fig = genre_facet_figure(final_df, title=f'Genres in {country_name}')
     # trace = go.Scatter(x=filtered_df['snapshot_date'], y=filtered_df['value'], mode='lines')
     # layout = go.Layout(title='Time Series Visualization', xaxis=dict(title='Date'), yaxis=dict(title='Value'))
     return fig
@@ -218,18 +162,3 @@ def find_factors(n_country):
             f2 = n_country // f1
     
     return f1, f2
-
-def filter_by_country_and_date(start_date, end_date, country_name, drop_duplicates=False, drop_subset=None, cols=[]):
-    
-    date_country_filtered = spotify_top50_daily_wGenres[(spotify_top50_daily_wGenres['snapshot_date'] >= start_date) &
-                                              (spotify_top50_daily_wGenres['snapshot_date'] <= end_date) & 
-                                              (spotify_top50_daily_wGenres['country_name'] == country_name)
-                                              ]
-    
-    if drop_duplicates:
-        date_country_filtered = date_country_filtered.drop_duplicates(subset=drop_subset, keep='first')
-    
-    if cols:
-        date_country_filtered = date_country_filtered[cols]
-    
-    return date_country_filtered
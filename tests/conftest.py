@@ -0,0 +1,34 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import benchmark
+import data_store
+
+
+@pytest.fixture
+def chart_dir(tmp_path, monkeypatch):
+    '''
+        working directory with a small generated chart in ./data, the days of the last week
+        moved to one CSV file per day for ingestion, and no loaded data version. Some songs
+        chart twice on a day, like in the Spotify data
+    '''
+    benchmark.generate(str(tmp_path), countries=4, days=30, tracks=400, pool=120, genres=200)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(data_store, '_state', None)
+
+    chart = pd.read_csv(data_store.CHART_PATH)
+    duplicates = chart.sample(frac=0.05, random_state=0)
+    duplicates['daily_rank'] = np.random.default_rng(0).integers(1, 51, len(duplicates))
+    chart = pd.concat([chart, duplicates], ignore_index=True)
+    chart.to_csv('full.csv', index=False)
+    days = sorted(chart['snapshot_date'].unique())
+    for day in days[-7:]:
+        chart[chart['snapshot_date'] == day].to_csv(f'{day}.csv', index=False)
+    chart[chart['snapshot_date'] < days[-7]].to_csv(data_store.CHART_PATH, index=False)
+    return tmp_path, days[-7:]
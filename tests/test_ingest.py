@@ -0,0 +1,93 @@
+import gc
+import logging
+import os
+import numpy as np
+import pandas as pd
+import data_store
+import ingest
+
+
+def test_rebuild_after_append_keeps_the_ingested_days(chart_dir):
+    _, days = chart_dir
+    ingest.build()
+    for day in days:
+        ingest.append([f'{day}.csv'])
+
+    # the same CSV, e.g. after a CACHE_VERSION bump
+    ingest.build()
+    data_store._state = None
+    chart = data_store.load_chart(['country_name', 'snapshot_date', 'track_name'])
+    assert len(chart) == len(pd.read_csv('full.csv'))
+    assert data_store.date_span()[1] == days[-1]
+    assert data_store.data_version() == len(days)
+
+
+def test_rebuild_from_another_csv_drops_the_ingested_days(chart_dir, caplog):
+    _, days = chart_dir
+    ingest.build()
+    ingest.append([f'{days[0]}.csv'])
+
+    base = pd.read_csv(data_store.CHART_PATH)
+    base.iloc[100:].to_csv(data_store.CHART_PATH, index=False)
+    with caplog.at_level(logging.WARNING, logger='data_store'):
+        ingest.build()
+    assert days[0] in caplog.text
+
+    data_store._state = None
+    assert len(data_store.load_chart(['country_name', 'snapshot_date'])) == len(base) - 100
+    assert data_store.data_version() == 0
+
+
+def test_state_keeps_reading_its_own_version(chart_dir):
+    ingest.build()
+    expected = data_store.normalize_chart(data_store.read_chart_csv(data_store.CHART_PATH))
+    state = data_store.current_state()
+    loaded = data_store.load_chart(['country_name', 'snapshot_date'], state)
+
+    # the CSV is replaced and rebuilt after the state loaded its first columns
+    expected.iloc[500:].to_csv(data_store.CHART_PATH, index=False)
+    data_store.ensure_chart_cache()
+    chart = data_store.load_chart(['track_name', 'daily_rank'], state)
+    assert len(chart) == len(loaded) == len(expected)
+    assert np.array_equal(chart['daily_rank'].to_numpy(), expected['daily_rank'].to_numpy())
+    assert np.array_equal(chart['track_name'].astype(str).to_numpy(), expected['track_name'].astype(str).to_numpy())
+    assert len(data_store.read_chart(['daily_rank'])) == len(expected) - 500
+
+    # the version is deleted by the next build once no state reads it
+    data_store._state = None
+    del state, loaded, chart
+    gc.collect()
+    ingest.build()
+    assert len(os.listdir(data_store.VERSIONS_DIR)) == 1
+
+
+def _mapped(values):
+    while values is not None and not isinstance(values, np.memmap):
+        values = values.base
+    return values is not None
+
+
+def test_refresh_maps_the_appended_rows(chart_dir):
+    _, days = chart_dir
+    ingest.build()
+    columns = ['country_name', 'snapshot_date', 'daily_rank', 'track_name']
+    data_store.load_chart(columns)
+    country = data_store.country_options()[0]['value']
+    data_store.rank_matrix(country)
+    for day in days:
+        ingest.append([f'{day}.csv'])
+    assert data_store.refresh()
+
+    chart = data_store.load_chart(columns)
+    assert _mapped(chart['daily_rank'].to_numpy())
+    assert _mapped(chart['snapshot_date'].to_numpy())
+    assert _mapped(chart['track_name'].cat.codes.to_numpy())
+
+    # the same rows in the same order as a state that loads the appended version from scratch
+    fresh = data_store._new_state()
+    pd.testing.assert_frame_equal(chart[columns], data_store.load_chart(columns, fresh))
+    for key, values in data_store.rank_matrix(country).items():
+        assert np.array_equal(values, data_store.rank_matrix(country, fresh)[key])
+    expected = data_store.normalize_chart(data_store.read_chart_csv('full.csv'))
+    assert np.array_equal(chart['daily_rank'].to_numpy(), expected['daily_rank'].to_numpy())
+    assert np.array_equal(chart['track_name'].astype(str).to_numpy(), expected['track_name'].astype(str).to_numpy())
@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import subprocess
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pytest
+import data_store
+import ingest
+
+
+@pytest.fixture(params=['built', 'appended'])
+def chart(request, chart_dir):
+    '''
+        the full chart, loaded either from a cache built from it or by appending its last week
+        to a state whose rank matrices, snapshots and genre index were built before
+    '''
+    _, days = chart_dir
+    if request.param == 'built':
+        shutil.copy('full.csv', data_store.CHART_PATH)
+        ingest.build()
+    else:
+        ingest.build()
+        for option in data_store.country_options():
+            data_store.rank_matrix(option['value'])
+            data_store.snapshot_rows(option['value'], days[0])
+        data_store.genre_index()
+        for day in days:
+            ingest.append([f'{day}.csv'])
+        assert data_store.refresh()
+    return pd.read_csv('full.csv', parse_dates=['snapshot_date'])
+
+
+def _date_ranges(chart, n, seed):
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(chart['snapshot_date'].min(), chart['snapshot_date'].max()).strftime('%Y-%m-%d')
+    for number in range(n):
+        first, last = sorted(rng.choice(len(days), 2))
+        # single days too
+        yield days[first], days[first if number % 5 == 0 else last]
+
+
+def _baseline_summary(chart, start_date, end_date, country_name):
+    '''
+        track names and mean ranks of the bump chart, computed like the original ranking page
+    '''
+    rows = chart[(chart['country_name'] == country_name) & (chart['snapshot_date'] >= start_date) & (chart['snapshot_date'] <= end_date)]
+    days_in = rows['track_name'].value_counts()
+    threshold = days_in.tolist()[data_store.STAYING_TRACKS - 1]
+    staying = rows[rows['track_name'].map(days_in) >= threshold]
+    summary = staying.groupby(['track_name', 'artists']).agg(mean_rank=('daily_rank', 'mean')).reset_index()
+    summary['mean_rank'] = summary['mean_rank'].round(2)
+    # stable, so ties stay in (track, artists) order like the rank matrix breaks them
+    summary = summary.sort_values('mean_rank', kind='stable').head(data_store.TOP_TRACKS)
+    return summary['track_name'].tolist(), summary['mean_rank'].tolist()
+
+
+def test_staying_power_matches_the_baseline(chart):
+    countries = chart['country_name'].unique()
+    for number, (start_date, end_date) in enumerate(_date_ranges(chart, 40, seed=1)):
+        country = countries[number % len(countries)]
+        names, mean_ranks = _baseline_summary(chart, start_date, end_date, country)
+        codes, got = data_store.staying_power_summary(start_date, end_date, country)
+        # the categories of appended rows are not sorted, so neither are the ties
+        assert got.tolist() == mean_ranks
+        if data_store.data_version() == 0:
+            assert data_store.load_chart(['track_name'])['track_name'].cat.categories[codes].tolist() == names
+
+
+def _cells(matrix):
+    '''
+        every chart row of the matrix as a (song, track, artists, day, rank) count
+    '''
+    cells = Counter()
+    rows, days = np.nonzero(matrix['ranks'])
+    for row, day in zip(rows, days):
+        cells[(*matrix['keys'][row], matrix['first_day'] + day, matrix['ranks'][row, day])] += 1
+    for row, day, rank in zip(matrix['extra_rows'], matrix['extra_days'], matrix['extra_ranks']):
+        cells[(*matrix['keys'][row], day, rank)] += 1
+    return cells
+
+
+def test_rank_matrix_extends_in_any_chunks(chart):
+    state = data_store.current_state()
+    offsets = data_store.chart_index(state)['offsets']
+    rng = np.random.default_rng(2)
+    for code in range(len(offsets) - 1):
+        rows = data_store._matrix_rows(state, offsets[code], offsets[code + 1])
+        whole = data_store._extend_rank_matrix(None, *rows)
+        assert len(whole['extra_rows'])
+        matrix = None
+        for part in np.array_split(rng.permutation(len(rows[0])), 4):
+            matrix = data_store._extend_rank_matrix(matrix, *[values[part] for values in rows])
+        assert _cells(matrix) == _cells(whole)
+        assert sum(_cells(whole).values()) == len(rows[0])
+
+
+def test_appended_state_matches_a_fresh_one(chart):
+    fresh = data_store._new_state()
+    countries = chart['country_name'].unique()
+    for number, (start_date, end_date) in enumerate(_date_ranges(chart, 20, seed=3)):
+        country = countries[number % len(countries)]
+        pd.testing.assert_frame_equal(data_store.top_tracks_by_staying_power(start_date, end_date, country),
+                                      data_store.top_tracks_by_staying_power(start_date, end_date, country, state=fresh))
+        pd.testing.assert_frame_equal(data_store.genre_space(start_date, end_date, list(countries[:number % 4])),
+                                      data_store.genre_space(start_date, end_date, list(countries[:number % 4]), state=fresh))
+        assert np.array_equal(data_store.snapshot_rows(country, end_date), data_store.snapshot_rows(country, end_date, fresh))
+
+
+def test_backends_agree(chart):
+    pytest.importorskip('duckdb')
+    countries = list(chart['country_name'].unique())
+    for number, (start_date, end_date) in enumerate(_date_ranges(chart, 20, seed=4)):
+        country = countries[number % len(countries)] if number % 7 else 'Nowhere'
+        pd.testing.assert_frame_equal(data_store.top_tracks_by_staying_power(start_date, end_date, country, backend='pandas'),
+                                      data_store.top_tracks_by_staying_power(start_date, end_date, country, backend='duckdb'))
+        selection = countries[:number % 4] + ['Nowhere'] * (number % 3 == 0)
+        pd.testing.assert_frame_equal(data_store.genre_space(start_date, end_date, selection, backend='pandas'),
+                                      data_store.genre_space(start_date, end_date, selection, backend='duckdb'))
+
+
+# Runs assets/bump_chart.js on every case of cases.json and prints the traces it draws
+BUMP_CHART_RUNNER = '''
+global.window = {dash_clientside: {no_update: null}};
+global.atob = (text) => Buffer.from(text, 'base64').toString('binary');
+eval(require('fs').readFileSync(process.argv[2], 'utf8'));
+const {cases, stores} = JSON.parse(require('fs').readFileSync(process.argv[3], 'utf8'));
+console.log(JSON.stringify(cases.map((c) => window.dash_clientside.ranking.bumpChart(stores[c.country], c.start, c.end).data
+    .map((trace) => ({name: trace.name, x: trace.x, y: trace.y, color: trace.line.color})))));
+'''
+
+
+def _traces(traces):
+    # lines in any order, their points in date order with same-day points in any order
+    return sorted((trace['name'], sorted(zip(trace['x'], trace['y']))) for trace in traces)
+
+
+def test_bump_chart_js_matches_the_server(chart, tmp_path):
+    if shutil.which('node') is None:
+        pytest.skip('node is not installed')
+    import figures
+    from plotly.io.json import to_json_plotly
+
+    countries = list(chart['country_name'].unique()) + ['Nowhere']
+    cases, expected = [], []
+    for number, (start_date, end_date) in enumerate(_date_ranges(chart, 20, seed=5)):
+        country = countries[number % len(countries)]
+        server = figures.bump_chart_figure(data_store.top_tracks_by_staying_power(start_date, end_date, country), title='')
+        expected.append(_traces({'name': trace['name'], 'x': trace['x'], 'y': trace['y']} for trace in server['data']))
+        # the date picker may add a midnight time
+        cases.append({'country': country, 'start': start_date, 'end': end_date + ('T00:00:00' if number % 2 else '')})
+    stores = {country: json.loads(to_json_plotly(figures.bump_chart_store(country, ''))) for country in countries}
+    (tmp_path / 'cases.json').write_text(json.dumps({'cases': cases, 'stores': stores}))
+    (tmp_path / 'runner.js').write_text(BUMP_CHART_RUNNER)
+
+    script = os.path.join(os.path.dirname(data_store.__file__), 'assets', 'bump_chart.js')
+    process = subprocess.run(['node', str(tmp_path / 'runner.js'), script, str(tmp_path / 'cases.json')],
+                             capture_output=True, text=True, check=True)
+    drawn = json.loads(process.stdout)
+    assert any(expected)
+    assert [_traces(traces) for traces in drawn] == expected
+    assert all(trace['color'] in figures.BUMP_COLORS for traces in drawn for trace in traces)